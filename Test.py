@@ -28,6 +28,9 @@ import StartPython
 
 # import advanced_pattern.Filter
 # import advanced_pattern.ObjectPool
+# import advanced_pattern.ObjectPool_async
+# import advanced_pattern.ObjectPool_shared
+# import advanced_pattern.ObjectPool_striped
 # import advanced_pattern.Callback
 
 # import application.ImageProcessing
@@ -163,37 +163,981 @@ class Skateboarding(Skill):
 # =======================================================================================================================
 import requests
 # 引入Http请求模块
-from threading import Thread
+from threading import Thread, Lock, Condition
 # 引入线程模块
+from concurrent.futures import ThreadPoolExecutor
+# 引入线程池, 用于分段并行下载
+import os
+# 引入操作系统模块, 用于按偏移量写文件
+import json
+# 引入json模块, 用于保存断点信息
+import time
+# 引入时间模块
+import errno
+# 引入错误码模块, 用于判断sendfile是否不可用
+import heapq
+# 引入堆队列, 用作优先级队列
+import itertools
+# 引入迭代器工具模块, 用于生成等待令牌的请求的序号
+from collections import namedtuple, deque
+# 引入具名元组和双端队列, 分别用于下载进度和回调的事件队列
+import traceback
+# 引入异常跟踪模块, 用于打印回调抛出的异常
+from urllib.parse import urlsplit
+# 引入URL解析函数, 用于取出协议、主机和路径
+from urllib.request import url2pathname
+# 引入url2pathname, 将file地址的路径转换为本地路径
+
+"""下载进度事件: 速度的单位为字节/秒, 剩余时间的单位为秒(文件大小或速度未知时为None)"""
+DownloadProgress = namedtuple("DownloadProgress", ["fileName", "readSize", "totalSize", "speed", "eta"])
+
+
+class ProgressReporter:
+    """统计下载进度, 并按时间间隔或百分比步长合并回调
+    每收到一块数据只做一次加法和比较, 到了该回调的时候才读时钟、计算速度和剩余时间"""
+
+    # 计算速度时新样本的权重(指数移动平均)
+    SMOOTHING = 0.3
+
+    def __init__(self, fileName, totalSize, callback, interval=0.1, step=None, readSize=0):
+        """totalSize为None表示文件大小未知; callback的参数为DownloadProgress
+        interval为两次回调的最小间隔(秒); step为回调的百分比步长(如1表示每下载1%回调一次), 设置后不再按时间间隔回调"""
+        self.__fileName = fileName
+        self.__totalSize = totalSize
+        self.__callback = callback
+        self.__interval = interval
+        self.__stepSize = max(totalSize * step // 100, 1) if step and totalSize else None
+        self.__readSize = readSize
+        self.__lastReportSize = readSize
+        self.__lastReportTime = time.monotonic()
+        self.__speed = 0.0
+        self.__hasReported = False
+        # 下载量达到该值时才检查是否需要回调
+        self.__nextCheckSize = readSize + (self.__stepSize or 0)
+
+    def update(self, size):
+        """增加已下载的字节数"""
+        self.__readSize += size
+        if(self.__readSize < self.__nextCheckSize):
+            return
+        now = time.monotonic()
+        if(self.__stepSize is not None):
+            self.__nextCheckSize = self.__readSize + self.__stepSize
+        elif(now - self.__lastReportTime < self.__interval):
+            # 按当前速度估算, 在间隔的1/4之内不再读时钟
+            self.__nextCheckSize = self.__readSize + int(self.__speed * self.__interval / 4)
+            return
+        self.__report(now)
+
+    def finish(self):
+        """下载结束, 最后回调一次; 文件大小未知时以实际下载的大小为准"""
+        if(self.__totalSize is None):
+            self.__totalSize = self.__readSize
+        # 最后一次回调已经是最终的进度时不再重复回调
+        if(not self.__hasReported or self.__readSize != self.__lastReportSize):
+            self.__report(time.monotonic())
+
+    def getReadSize(self):
+        return self.__readSize
+
+    def getProgress(self):
+        """当前的下载进度"""
+        speed = self.__speed
+        eta = None
+        if(self.__totalSize is not None and speed > 0):
+            eta = max(self.__totalSize - self.__readSize, 0) / speed
+        return DownloadProgress(self.__fileName, self.__readSize, self.__totalSize, speed, eta)
+
+    def __report(self, now):
+        elapsed = now - self.__lastReportTime
+        if(elapsed > 0):
+            speed = (self.__readSize - self.__lastReportSize) / elapsed
+            self.__speed = speed if self.__speed == 0 else self.SMOOTHING * speed + (1 - self.SMOOTHING) * self.__speed
+        self.__lastReportTime = now
+        self.__lastReportSize = self.__readSize
+        self.__hasReported = True
+        self.__nextCheckSize = self.__readSize + (self.__stepSize or int(self.__speed * self.__interval / 4))
+        self.__callback(self.getProgress())
+
+
+class TokenBucket:
+    """令牌桶: 每秒放入rate个令牌(字节), 最多存burst个
+    取令牌时允许透支, 透支的部分要等令牌补上, 所以一次取的数量可以大于burst"""
+
+    def __init__(self, rate, burst=None):
+        self.__rate = rate
+        self.__burst = burst if burst is not None else max(rate // 10, 1)
+        self.__tokens = self.__burst
+        self.__lastTime = time.monotonic()
+        self.__lock = Lock()
+
+    def getRate(self):
+        return self.__rate
+
+    def consume(self, amount):
+        """取出amount个令牌, 返回调用者需要等待的秒数"""
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= amount
+            return max(-self.__tokens, 0) / self.__rate
+
+    def getWaitTime(self, amount):
+        """还要等多少秒才有amount个令牌(最多等到令牌桶装满)"""
+        with self.__lock:
+            self.__refill()
+            return max(min(amount, self.__burst) - self.__tokens, 0) / self.__rate
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__tokens + (now - self.__lastTime) * self.__rate, self.__burst)
+        self.__lastTime = now
+
+
+class BandwidthLimiter:
+    """全局限速, 并按权重在多个下载之间分配带宽
+    采用开始时间公平排队(SFQ): 每次请求按"虚拟开始时间"排队, 权重越大, 虚拟时间走得越慢, 分到的带宽越多;
+    空闲过的下载从当前的虚拟时间开始排队, 不能攒下额度, 后台下载再多也不会饿死交互下载"""
+
+    def __init__(self, rate, burst=None):
+        self.__bucket = TokenBucket(rate, burst)
+        self.__condition = Condition()
+        # 等待令牌的请求: (虚拟开始时间, 序号)
+        self.__waiters = []
+        self.__virtualTime = 0.0
+        self.__sequence = itertools.count()
+
+    def throttle(self, rate=None, weight=1):
+        """为一个下载创建限速器: rate为这个下载自己的限速(字节/秒), weight为分配全局带宽时的权重"""
+        return Throttle(rate, self, weight)
+
+    def acquire(self, amount, weight, lastFinishTag):
+        """按权重排队取出amount个令牌, 返回这次请求的虚拟结束时间, 作为同一个下载的下一次请求的lastFinishTag"""
+        with self.__condition:
+            startTag = max(lastFinishTag, self.__virtualTime)
+            waiter = (startTag, next(self.__sequence))
+            heapq.heappush(self.__waiters, waiter)
+            while True:
+                if(self.__waiters[0] is waiter):
+                    wait = self.__bucket.getWaitTime(amount)
+                    if(wait <= 0):
+                        break
+                    self.__condition.wait(wait)
+                else:
+                    self.__condition.wait()
+            heapq.heappop(self.__waiters)
+            self.__bucket.consume(amount)
+            self.__virtualTime = startTag
+            self.__condition.notify_all()
+            return startTag + amount / weight
+
+
+class Throttle:
+    """一个下载的限速器, 同时受自己的限速和全局限速器的约束"""
+
+    def __init__(self, rate=None, limiter=None, weight=1):
+        self.__bucket = TokenBucket(rate) if rate is not None else None
+        self.__limiter = limiter
+        self.__weight = weight
+        self.__finishTag = 0.0
+        # 分段下载的各段共用一个限速器, 依次排队
+        self.__lock = Lock()
+
+    def consume(self, amount):
+        """收到amount字节后调用, 超过限速时阻塞一段时间"""
+        with self.__lock:
+            if(self.__bucket is not None):
+                wait = self.__bucket.consume(amount)
+                if(wait > 0):
+                    time.sleep(wait)
+            if(self.__limiter is not None):
+                self.__finishTag = self.__limiter.acquire(amount, self.__weight, self.__finishTag)
+
+
+class CallbackDispatcher(metaclass=ABCMeta):
+    """回调的派发方式: 决定下载的回调函数在哪个线程中、以什么顺序执行"""
+
+    @abstractmethod
+    def dispatch(self, callback, args, isProgress):
+        """派发一次回调; isProgress为True表示进度事件, 否则为完成事件"""
+        pass
+
+    def progress(self, callback, *args):
+        self.dispatch(callback, args, True)
+
+    def finished(self, callback, *args):
+        self.dispatch(callback, args, False)
+
+    def getNumOfDropped(self):
+        """被丢弃的进度事件数量"""
+        return 0
+
+    def close(self, wait=True):
+        """关闭派发器; wait为True时等待已派发的回调执行完"""
+        pass
+
+
+class InlineDispatcher(CallbackDispatcher):
+    """在下载线程中直接调用回调(默认的方式), 回调抛出的异常会中断下载"""
+
+    def dispatch(self, callback, args, isProgress):
+        callback(*args)
+
+
+class QueuedDispatcher(CallbackDispatcher):
+    """把回调放入有界队列, 由其他线程执行, 慢的回调不会拖慢下载
+    队列满时丢弃最旧的进度事件(后面的进度会覆盖它); 完成事件从不丢弃, 队列中全是完成事件时等待队列空出位置"""
+
+    """队列的最大长度"""
+    MaxQueueSize = 1024
+
+    def __init__(self, maxQueueSize=None):
+        if(maxQueueSize is not None):
+            self.MaxQueueSize = maxQueueSize
+        # 事件: (回调, 参数, 是否为进度事件, 完成事件的序号)
+        self.__queue = deque()
+        self.__numOfProgress = 0
+        self.__numOfDropped = 0
+        self.__numOfFinished = 0
+        self.__isClosed = False
+        self.__condition = Condition()
+
+    def dispatch(self, callback, args, isProgress):
+        """放入队列, 返回放入之前队列是否为空"""
+        with self.__condition:
+            if(self.__isClosed):
+                raise RuntimeError("回调派发器已关闭")
+            while len(self.__queue) >= self.MaxQueueSize:
+                if(self.__numOfProgress > 0):
+                    self.__dropOldestProgress()
+                elif(isProgress):
+                    # 队列中全是完成事件, 新的进度事件就是最旧的进度事件
+                    self.__numOfDropped += 1
+                    return False
+                else:
+                    self.__condition.wait()
+            wasEmpty = not self.__queue
+            if(isProgress):
+                self.__numOfProgress += 1
+                self.__queue.append((callback, args, True, None))
+            else:
+                self.__queue.append((callback, args, False, self.__numOfFinished))
+                self.__numOfFinished += 1
+            self.__condition.notify_all()
+            return wasEmpty
+
+    def getNumOfDropped(self):
+        return self.__numOfDropped
+
+    def getQueueSize(self):
+        return len(self.__queue)
+
+    def close(self, wait=True):
+        with self.__condition:
+            self.__isClosed = True
+            if(not wait):
+                self.__queue.clear()
+                self.__numOfProgress = 0
+            self.__condition.notify_all()
+
+    def _takeEvent(self, block=True):
+        """取出最早的事件; 队列为空时, block为False或派发器已关闭则返回None"""
+        with self.__condition:
+            while not self.__queue:
+                if(not block or self.__isClosed):
+                    return None
+                self.__condition.wait()
+            event = self.__queue.popleft()
+            if(event[2]):
+                self.__numOfProgress -= 1
+            event = self._onTakeEvent(event)
+            self.__condition.notify_all()
+            return event
+
+    def _onTakeEvent(self, event):
+        """在队列的锁内、按取出的顺序调用, 返回交给执行线程的事件; 子类可重写该方法给事件附加信息"""
+        return event
+
+    def _runEvent(self, event):
+        """执行回调; 回调抛出的异常只打印出来, 不影响后面的回调"""
+        try:
+            event[0](*event[1])
+        except Exception:
+            traceback.print_exc()
+
+    def __dropOldestProgress(self):
+        for index, event in enumerate(self.__queue):
+            if(event[2]):
+                del self.__queue[index]
+                self.__numOfProgress -= 1
+                self.__numOfDropped += 1
+                return
+
+
+class ThreadDispatcher(QueuedDispatcher):
+    """由一个专门的线程按顺序执行所有的回调"""
+
+    def __init__(self, maxQueueSize=None):
+        super().__init__(maxQueueSize)
+        self.__thread = Thread(target=self.__work, name="CallbackDispatcher", daemon=True)
+        self.__thread.start()
+
+    def close(self, wait=True):
+        super().close(wait)
+        self.__thread.join()
+
+    def __work(self):
+        while True:
+            event = self._takeEvent()
+            if(event is None):
+                return
+            self._runEvent(event)
+
+
+class ThreadPoolDispatcher(QueuedDispatcher):
+    """由多个线程执行回调: 进度回调可能并发执行; 完成回调严格按派发的顺序依次执行,
+    并且等在它之前派发(且未被丢弃)的进度回调都执行完, 不会在完成之后才收到100%的进度"""
+
+    def __init__(self, numOfWorkers=4, maxQueueSize=None):
+        super().__init__(maxQueueSize)
+        # 下一个可以执行的完成事件的序号
+        self.__nextFinished = 0
+        # 进度事件按取出的顺序编号; 编号小于numOfProgressDone的进度事件都已执行完
+        self.__numOfProgressTaken = 0
+        self.__numOfProgressDone = 0
+        self.__doneProgress = set()
+        self.__orderCondition = Condition()
+        self.__workers = [Thread(target=self.__work, name="CallbackDispatcher-%d" % i, daemon=True)
+                          for i in range(0, numOfWorkers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def close(self, wait=True):
+        super().close(wait)
+        for worker in self.__workers:
+            worker.join()
+
+    def __work(self):
+        while True:
+            event = self._takeEvent()
+            if(event is None):
+                return
+            if(event[2]):
+                try:
+                    self._runEvent(event)
+                finally:
+                    self.__progressDone(event[4])
+                continue
+            # 前面的完成事件和进度事件已经被其他线程取走, 等它们执行完再执行这一个
+            with self.__orderCondition:
+                while self.__nextFinished != event[3] or self.__numOfProgressDone < event[4]:
+                    self.__orderCondition.wait()
+            try:
+                self._runEvent(event)
+            finally:
+                with self.__orderCondition:
+                    self.__nextFinished += 1
+                    self.__orderCondition.notify_all()
+
+    def _onTakeEvent(self, event):
+        """进度事件附加自己的编号, 完成事件附加在它之前取出的进度事件数量"""
+        number = self.__numOfProgressTaken
+        if(event[2]):
+            self.__numOfProgressTaken += 1
+        return event + (number,)
+
+    def __progressDone(self, number):
+        with self.__orderCondition:
+            self.__doneProgress.add(number)
+            while self.__numOfProgressDone in self.__doneProgress:
+                self.__doneProgress.remove(self.__numOfProgressDone)
+                self.__numOfProgressDone += 1
+            self.__orderCondition.notify_all()
+
+
+class AsyncioDispatcher(QueuedDispatcher):
+    """在asyncio的事件循环中按顺序执行回调, 回调中可以直接操作事件循环中的对象
+    不要在事件循环的线程中派发完成事件: 队列满时会等待, 而队列要在事件循环中才能清空"""
+
+    def __init__(self, loop, maxQueueSize=None):
+        super().__init__(maxQueueSize)
+        self.__loop = loop
+
+    def dispatch(self, callback, args, isProgress):
+        # 队列从空变为非空时安排一次清空队列, 之后放入的事件由同一次清空处理
+        if(super().dispatch(callback, args, isProgress)):
+            self.__loop.call_soon_threadsafe(self.__drain)
+
+    def __drain(self):
+        while True:
+            event = self._takeEvent(block=False)
+            if(event is None):
+                return
+            self._runEvent(event)
+
+
+class ResourceChangedError(IOError):
+    """服务器上的文件已经改变, 已下载的部分不能再用"""
+    pass
+
 
 class DownloadThread (Thread):
     """下载文件的线程"""
 
-    # 每次写文件的缓冲大小
+    # 每次写文件的缓冲大小(初始值)
     CHUNK_SIZE = 1024 * 512
-
-    def __init__(self, fileName, url, savePath, callBackProgerss, callBackFinished):
+    # 是否按实际的速度调整缓冲大小, 使每读写(包括限速等待)一次大约用CHUNK_TIME秒
+    ADAPTIVE_CHUNK = True
+    CHUNK_TIME = 0.05
+    MIN_CHUNK_SIZE = 1024 * 16
+    MAX_CHUNK_SIZE = 1024 * 1024 * 4
+    # 分段下载时每一段失败后的最大重试次数
+    MAX_RETRIES = 3
+    # 断点信息最多每隔多少秒保存一次
+    CHECKPOINT_INTERVAL = 1.0
+    # 进度回调的最小间隔(秒)
+    PROGRESS_INTERVAL = 0.1
+    # 进度回调的百分比步长, 设置后不再按时间间隔回调
+    PROGRESS_STEP = None
+
+    def __init__(self, fileName, url, savePath, callBackProgerss, callBackFinished, numOfSegments=1, resumable=False,
+                 session=None, throttle=None, dispatcher=None):
+        """numOfSegments大于1时, 如果服务器支持Range请求, 则把文件分成多段并行下载
+        resumable为True时, 在savePath.checkpoint中记录已下载的数据段, 重新下载时从断开的位置继续
+        session为多个下载共用的requests.Session, 可以复用保持连接(keep-alive)的连接池
+        throttle为限速器(Throttle), 可以由BandwidthLimiter.throttle创建, 在多个下载之间分配带宽
+        dispatcher为回调的派发方式(CallbackDispatcher), 默认在下载线程中直接调用"""
         super().__init__()
         self.__fileName = fileName
         self.__url = url
         self.__savePath = savePath
         self.__callbackProgress = callBackProgerss
         self.__callBackFionished = callBackFinished
+        self.__numOfSegments = numOfSegments
+        self.__resumable = resumable
+        self.__http = session if session is not None else requests
+        self.__throttle = throttle
+        self.__dispatcher = dispatcher if dispatcher is not None else InlineDispatcher()
+        self.__checkpointPath = savePath + ".checkpoint"
+        self.__progress = None
+        self.__totalSize = 0
+        self.__validator = {}
+        # 每一段的进度: [开始位置, 结束位置, 下一个要下载的位置]
+        self.__segments = []
+        self.__lastCheckpointTime = 0
+        self.__lock = Lock()
 
     def run(self):
-        readSize = 0
-        r = requests.get(self.__url, stream=True)
-        totalSize = int(r.headers.get('Content-Length'))
-        print("[下载%s] 文件大小:%d" % (self.__fileName, totalSize))
+        if(urlsplit(self.__url).scheme == "file"):
+            self.__copyLocalFile()
+            self.__dispatcher.finished(self.__callBackFionished, self.__fileName)
+            return
+        if(self.__numOfSegments > 1 or self.__resumable):
+            # 服务器上的文件改变时, 放弃已下载的部分从头再下载一次
+            for attempt in range(0, 2):
+                probe = self.__probe()
+                if(probe is None):
+                    break
+                totalSize, validator = probe
+                result = self.__downloadSegments(totalSize, validator)
+                if(result is True):
+                    self.__progress.finish()
+                    self.__dispatcher.finished(self.__callBackFionished, self.__fileName)
+                if(not isinstance(result, ResourceChangedError)):
+                    return
+                print("[下载%s] 服务器上的文件已改变, 重新下载" % self.__fileName)
+                self.__removeCheckpoint()
+            else:
+                return
+        r = self.__http.get(self.__url, stream=True)
+        # 没有Content-Length(如分块传输)时文件大小未知
+        contentLength = r.headers.get('Content-Length', "")
+        totalSize = int(contentLength) if contentLength.isdigit() else None
+        print("[下载%s] 文件大小:%s" % (self.__fileName, totalSize if totalSize is not None else "未知"))
+        self.__progress = ProgressReporter(self.__fileName, totalSize, self.__reportProgress,
+                                           self.PROGRESS_INTERVAL, self.PROGRESS_STEP)
         with open(self.__savePath, "wb") as file:
-            for chunk in r.iter_content(chunk_size = self.CHUNK_SIZE):
+            for chunk in self.__readChunks(r):
+                file.write(chunk)
+                self.__progress.update(len(chunk))
+                if(self.__throttle is not None):
+                    self.__throttle.consume(len(chunk))
+        self.__progress.finish()
+        self.__dispatcher.finished(self.__callBackFionished, self.__fileName)
+
+    def getProgress(self):
+        """当前的下载进度(DownloadProgress), 还没有开始下载时返回None"""
+        return self.__progress.getProgress() if self.__progress is not None else None
+
+    def __reportProgress(self, progress):
+        self.__dispatcher.progress(self.__callbackProgress, progress.fileName, progress.readSize, progress.totalSize)
+
+    def __probe(self):
+        """请求第一个字节, 服务器返回206时说明支持Range请求, 返回(文件大小, ETag/Last-Modified校验信息); 否则返回None"""
+        with self.__http.get(self.__url, headers={"Range": "bytes=0-0"}, stream=True) as r:
+            contentRange = r.headers.get("Content-Range", "")
+            if(r.status_code != 206 or "/" not in contentRange):
+                return None
+            totalSize = contentRange.rsplit("/", 1)[1]
+            validator = {key: r.headers[key] for key in ("ETag", "Last-Modified") if key in r.headers}
+            return (int(totalSize), validator) if totalSize.isdigit() else None
+
+    def __downloadSegments(self, totalSize, validator):
+        """分段并行下载, 每一段写入预先分配好大小的文件的对应位置
+        全部成功返回True; 服务器上的文件改变时返回ResourceChangedError; 其他失败返回False"""
+        self.__totalSize = totalSize
+        self.__validator = validator
+        self.__segments = self.__loadCheckpoint(totalSize, validator)
+        if(self.__segments is None):
+            segmentSize = -(-totalSize // self.__numOfSegments)
+            self.__segments = [[start, min(start + segmentSize, totalSize) - 1, start]
+                               for start in range(0, totalSize, segmentSize)]
+        readSize = sum(segment[2] - segment[0] for segment in self.__segments)
+        self.__progress = ProgressReporter(self.__fileName, totalSize, self.__reportProgress,
+                                           self.PROGRESS_INTERVAL, self.PROGRESS_STEP, readSize)
+        pendingSegments = [segment for segment in self.__segments if segment[2] <= segment[1]]
+        if(readSize > 0):
+            print("[下载%s] 文件大小:%d, 从断点继续, 已下载%d字节" % (self.__fileName, totalSize, readSize))
+        else:
+            print("[下载%s] 文件大小:%d, 分%d段下载" % (self.__fileName, totalSize, len(self.__segments)))
+
+        fd = os.open(self.__savePath, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            os.ftruncate(fd, totalSize)
+            with ThreadPoolExecutor(max_workers=max(len(pendingSegments), 1)) as executor:
+                futures = [executor.submit(self.__downloadSegment, fd, segment) for segment in pendingSegments]
+                errors = [future.exception() for future in futures if future.exception() is not None]
+            if(errors and self.__resumable):
+                self.__saveCheckpoint(fd)
+        finally:
+            os.close(fd)
+        if(errors):
+            for error in errors:
+                if(isinstance(error, ResourceChangedError)):
+                    return error
+            print("[下载%s] 下载失败:%s" % (self.__fileName, errors[0]))
+            return False
+        self.__removeCheckpoint()
+        return True
+
+    def __downloadSegment(self, fd, segment):
+        """下载一段数据; 失败时从断开的位置重试, 最多重试MAX_RETRIES次"""
+        start, end = segment[0], segment[1]
+        for retry in range(0, self.MAX_RETRIES + 1):
+            try:
+                headers = {"Range": "bytes=%d-%d" % (segment[2], end)}
+                # 带上If-Range: 文件改变时服务器会返回整个文件(200)而不是这一段
+                validator = self.__validator.get("ETag") or self.__validator.get("Last-Modified")
+                if(validator is not None):
+                    headers["If-Range"] = validator
+                with self.__http.get(self.__url, headers=headers, stream=True, timeout=30) as r:
+                    if(r.status_code == 200 and validator is not None):
+                        raise ResourceChangedError("服务器上的文件已改变")
+                    # 校验服务器返回的正是请求的这一段
+                    if(r.status_code != 206 or not r.headers.get("Content-Range", "").startswith("bytes %d-" % segment[2])):
+                        raise IOError("服务器没有返回请求的数据段 %s" % headers["Range"])
+                    for chunk in self.__readChunks(r):
+                        chunk = chunk[:end + 1 - segment[2]]
+                        self.__writeAt(fd, chunk, segment[2])
+                        self.__addProgress(fd, segment, len(chunk))
+                        if(self.__throttle is not None):
+                            self.__throttle.consume(len(chunk))
+                if(segment[2] > end):
+                    return
+                raise IOError("数据段 %d-%d 不完整" % (start, end))
+            except ResourceChangedError:
+                raise
+            except (requests.RequestException, IOError) as e:
+                if(retry == self.MAX_RETRIES):
+                    raise
+                print("[下载%s] 数据段 %d-%d 下载出错, 重试:%s" % (self.__fileName, start, end, e))
+
+    def __readChunks(self, r):
+        """读取响应体的数据块; 反复读入同一个缓冲区, 返回的memoryview只在下一次迭代之前有效"""
+        if(r.headers.get("Content-Encoding", "identity") != "identity"):
+            # 压缩过的内容由requests解压
+            for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
                 if chunk:
-                    file.write(chunk)
-                    readSize += self.CHUNK_SIZE
-                    self.__callbackProgress(self.__fileName, readSize, totalSize)
-        self.__callBackFionished(self.__fileName)
+                    yield chunk
+            return
+        chunkSize = self.CHUNK_SIZE
+        view = memoryview(bytearray(chunkSize))
+        while True:
+            start = time.perf_counter()
+            size = r.raw.readinto(view[:chunkSize])
+            if not size:
+                return
+            yield view[:size]
+            if(self.ADAPTIVE_CHUNK):
+                # 限速时每次循环的时间变长, 缓冲区随之变小, 数据流更平稳
+                chunkSize = self.__adjustChunkSize(chunkSize, time.perf_counter() - start)
+                if(chunkSize > len(view)):
+                    view = memoryview(bytearray(chunkSize))
+
+    def __adjustChunkSize(self, chunkSize, elapsed):
+        """读得太快时加倍缓冲区, 减少调用次数; 读得太慢时减半, 让进度和断点及时更新"""
+        if(elapsed < self.CHUNK_TIME / 2 and chunkSize < self.MAX_CHUNK_SIZE):
+            return chunkSize * 2
+        if(elapsed > self.CHUNK_TIME * 2 and chunkSize > self.MIN_CHUNK_SIZE):
+            return chunkSize // 2
+        return chunkSize
+
+    def __copyLocalFile(self):
+        """复制本地文件(file://地址), 优先用os.sendfile在内核中复制, 数据不经过用户态"""
+        path = url2pathname(urlsplit(self.__url).path)
+        totalSize = os.path.getsize(path)
+        print("[下载%s] 文件大小:%d" % (self.__fileName, totalSize))
+        self.__progress = ProgressReporter(self.__fileName, totalSize, self.__reportProgress,
+                                           self.PROGRESS_INTERVAL, self.PROGRESS_STEP)
+        useSendfile = hasattr(os, "sendfile")
+        view = None
+        offset = 0
+        with open(path, "rb") as source, open(self.__savePath, "wb") as target:
+            while offset < totalSize:
+                if(useSendfile):
+                    try:
+                        size = os.sendfile(target.fileno(), source.fileno(), offset, self.MAX_CHUNK_SIZE)
+                    except OSError as e:
+                        # 有的系统只能sendfile到socket(如macOS), 改为普通的读写
+                        if(e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK) or offset > 0):
+                            raise
+                        useSendfile = False
+                if(not useSendfile):
+                    if(view is None):
+                        view = memoryview(bytearray(self.MAX_CHUNK_SIZE))
+                    size = source.readinto(view)
+                    target.write(view[:size])
+                if(size == 0):
+                    break
+                offset += size
+                self.__progress.update(size)
+                if(self.__throttle is not None):
+                    self.__throttle.consume(size)
+        self.__progress.finish()
+
+    def __writeAt(self, fd, data, offset):
+        if(hasattr(os, "pwrite")):
+            os.pwrite(fd, data, offset)
+        else:
+            # Windows上没有pwrite, 多个数据段共用文件描述符时需要加锁
+            with self.__lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                os.write(fd, data)
+
+    def __addProgress(self, fd, segment, size):
+        # 在锁内回调, 保证进度是递增的
+        with self.__lock:
+            segment[2] += size
+            self.__progress.update(size)
+            if(self.__resumable and time.monotonic() - self.__lastCheckpointTime >= self.CHECKPOINT_INTERVAL):
+                self.__saveCheckpoint(fd)
+
+    def __saveCheckpoint(self, fd):
+        """先把数据刷到磁盘, 再写临时文件并原子地替换断点文件, 断点文件不会只写了一半"""
+        os.fsync(fd)
+        checkpoint = {"url": self.__url, "totalSize": self.__totalSize, "validator": self.__validator,
+                      "segments": self.__segments}
+        tempPath = self.__checkpointPath + ".tmp"
+        with open(tempPath, "w") as file:
+            json.dump(checkpoint, file)
+            # 临时文件的内容落盘后再替换, 否则崩溃后可能只剩下改名而内容为空
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tempPath, self.__checkpointPath)
+        self.__lastCheckpointTime = time.monotonic()
+
+    def __loadCheckpoint(self, totalSize, validator):
+        """读取断点信息, 文件或服务器上的文件已改变时返回None"""
+        if(not self.__resumable or not os.path.exists(self.__checkpointPath) or not os.path.exists(self.__savePath)):
+            return None
+        try:
+            with open(self.__checkpointPath) as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if(checkpoint.get("url") != self.__url or checkpoint.get("totalSize") != totalSize
+                or checkpoint.get("validator") != validator or not validator):
+            return None
+        return checkpoint["segments"]
+
+    def __removeCheckpoint(self):
+        if(os.path.exists(self.__checkpointPath)):
+            os.remove(self.__checkpointPath)
+
+
+
+# 下载管理器
+# =======================================================================================================================
+from requests.adapters import HTTPAdapter
+# 引入Http适配器, 用于设置共享会话的连接池大小
+
+class DownloadManager:
+    """下载管理器
+    固定数量的工作线程从优先级队列中取下载任务执行, 所有任务共用一个保持连接的连接池,
+    并限制同一主机同时下载的数量; 排队的任务再多, 线程数和连接数也不会超过上限"""
+
+    def __init__(self, maxWorkers=4, maxPerHost=2):
+        self.__maxPerHost = maxPerHost
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=maxWorkers, pool_maxsize=maxWorkers)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        # 每个主机一个任务队列: (-优先级, 序号, 下载任务), 优先级越大越先下载, 同优先级先来先下载
+        self.__hostQueues = {}
+        # 可以执行任务的主机(有排队的任务且未达到并发上限): (队首任务的(-优先级, 序号), 主机)
+        # 队首改变时放入新的记录, 旧的记录在取出时丢弃, 不用在堆中查找和删除
+        self.__readyHosts = []
+        self.__sequence = 0
+        self.__numOfPending = 0
+        self.__numOfActive = 0
+        self.__activePerHost = {}
+        self.__isShutdown = False
+        lock = Lock()
+        # 工作线程等待任务, 每次只唤醒一个
+        self.__condition = Condition(lock)
+        # join等待所有任务完成
+        self.__allDone = Condition(lock)
+        self.__workers = [Thread(target=self.__work, name="DownloadWorker-%d" % i, daemon=True)
+                          for i in range(0, maxWorkers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def addDownload(self, fileName, url, savePath, callBackProgerss, callBackFinished, priority=0, **options):
+        """添加下载任务, options为DownloadThread的其他参数(如numOfSegments、resumable)"""
+        download = DownloadThread(fileName, url, savePath, callBackProgerss, callBackFinished,
+                                  session=self.__session, **options)
+        host = urlsplit(url).netloc
+        with self.__condition:
+            if(self.__isShutdown):
+                raise RuntimeError("下载管理器已关闭")
+            queue = self.__hostQueues.setdefault(host, [])
+            key = (-priority, self.__sequence)
+            self.__sequence += 1
+            heapq.heappush(queue, (key[0], key[1], download))
+            self.__numOfPending += 1
+            # 新任务排在队首时, 主机在就绪堆中的位置要更新
+            if(queue[0][2] is download):
+                self.__markReady(host)
+            self.__condition.notify()
+
+    def getNumOfPending(self):
+        with self.__condition:
+            return self.__numOfPending
+
+    def join(self):
+        """等待所有的下载任务完成"""
+        with self.__allDone:
+            while self.__numOfPending > 0 or self.__numOfActive > 0:
+                self.__allDone.wait()
+
+    def shutdown(self, wait=True):
+        """关闭下载管理器; wait为True时先等待所有任务完成, 否则丢弃排队中的任务"""
+        if(wait):
+            self.join()
+        with self.__condition:
+            self.__isShutdown = True
+            self.__hostQueues.clear()
+            self.__readyHosts.clear()
+            self.__numOfPending = 0
+            self.__condition.notify_all()
+            self.__allDone.notify_all()
+        for worker in self.__workers:
+            worker.join()
+        self.__session.close()
+
+    def __markReady(self, host):
+        """主机有排队的任务且未达到并发上限时, 按队首任务放入就绪堆"""
+        queue = self.__hostQueues.get(host)
+        if(queue and self.__activePerHost.get(host, 0) < self.__maxPerHost):
+            heapq.heappush(self.__readyHosts, (queue[0][:2], host))
+
+    def __takeTask(self):
+        """取出优先级最高、且所在主机未达到并发上限的任务, 返回(主机, 下载任务); 没有可执行的任务时返回None"""
+        while self.__readyHosts:
+            key, host = heapq.heappop(self.__readyHosts)
+            queue = self.__hostQueues.get(host)
+            # 丢弃过期的记录: 队首已经改变或主机已达到并发上限
+            if(not queue or queue[0][:2] != key or self.__activePerHost.get(host, 0) >= self.__maxPerHost):
+                continue
+            download = heapq.heappop(queue)[2]
+            if(not queue):
+                del self.__hostQueues[host]
+            self.__numOfPending -= 1
+            self.__activePerHost[host] = self.__activePerHost.get(host, 0) + 1
+            self.__markReady(host)
+            return host, download
+        return None
+
+    def __work(self):
+        while True:
+            with self.__condition:
+                task = self.__takeTask()
+                while task is None:
+                    if(self.__isShutdown):
+                        return
+                    self.__condition.wait()
+                    task = self.__takeTask()
+                host, download = task
+                self.__numOfActive += 1
+            try:
+                # 在工作线程中直接执行下载, 不再为每个下载创建线程
+                download.run()
+            except Exception as e:
+                print("[下载管理器] 下载出错:%s" % e)
+            finally:
+                with self.__condition:
+                    self.__activePerHost[host] -= 1
+                    if(self.__activePerHost[host] == 0):
+                        del self.__activePerHost[host]
+                    self.__numOfActive -= 1
+                    # 主机从上限降下来, 又可以执行它的任务了
+                    if(self.__activePerHost.get(host, 0) == self.__maxPerHost - 1):
+                        self.__markReady(host)
+                        self.__condition.notify()
+                    if(self.__numOfPending == 0 and self.__numOfActive == 0):
+                        self.__allDone.notify_all()
+
+
+# 基于asyncio的下载
+# =======================================================================================================================
+import asyncio
+# 引入异步IO模块
+import ssl
+# 引入SSL模块, 用于下载https地址
 
 
+class AsyncDownload:
+    """在事件循环中下载文件的协程任务, 与DownloadThread的回调方式相同
+    所有的下载共用一个线程, 用非阻塞的socket收发数据; 可以await等待下载完成, 也可以用async for逐个获取进度事件"""
+
+    # 每次从socket读取的最大字节数
+    CHUNK_SIZE = 1024 * 512
+    # 进度回调的最小间隔(秒)
+    PROGRESS_INTERVAL = 0.1
+    # 进度回调的百分比步长, 设置后不再按时间间隔回调
+    PROGRESS_STEP = None
+
+    def __init__(self, fileName, url, savePath, callBackProgerss=None, callBackFinished=None, dispatcher=None):
+        """dispatcher为回调的派发方式(CallbackDispatcher), 默认在事件循环中直接调用"""
+        self.__fileName = fileName
+        self.__url = url
+        self.__savePath = savePath
+        self.__callbackProgress = callBackProgerss
+        self.__callBackFionished = callBackFinished
+        self.__dispatcher = dispatcher if dispatcher is not None else InlineDispatcher()
+        self.__task = None
+        self.__progress = None
+        # 每个进度迭代器一个队列
+        self.__listeners = []
+
+    def start(self):
+        """在当前的事件循环中开始下载, 返回self"""
+        if(self.__task is None):
+            self.__task = asyncio.ensure_future(self.run())
+        return self
+
+    def __await__(self):
+        """等待下载完成, 返回保存的路径; 下载失败时抛出异常"""
+        return self.start().__task.__await__()
+
+    async def events(self):
+        """进度事件的异步迭代器, 下载结束(完成或失败)时结束迭代; 下载已经结束时只返回最后的进度"""
+        if(self.__task is not None and self.__task.done()):
+            progress = self.getProgress()
+            if(progress is not None):
+                yield progress
+            return
+        queue = asyncio.Queue()
+        self.__listeners.append(queue)
+        self.start()
+        try:
+            while True:
+                event = await queue.get()
+                if(event is None):
+                    return
+                yield event
+        finally:
+            self.__listeners.remove(queue)
+
+    async def run(self):
+        try:
+            reader, writer, headers = await self.__request()
+            try:
+                contentLength = headers.get("content-length", "")
+                totalSize = int(contentLength) if contentLength.isdigit() else None
+                print("[下载%s] 文件大小:%s" % (self.__fileName, totalSize if totalSize is not None else "未知"))
+                self.__progress = ProgressReporter(self.__fileName, totalSize, self.__notify,
+                                                   self.PROGRESS_INTERVAL, self.PROGRESS_STEP)
+                with open(self.__savePath, "wb") as file:
+                    async for chunk in self.__readBody(reader, headers):
+                        file.write(chunk)
+                        self.__progress.update(len(chunk))
+                if(totalSize is not None and self.__progress.getReadSize() != totalSize):
+                    raise IOError("下载不完整: %d/%d" % (self.__progress.getReadSize(), totalSize))
+                self.__progress.finish()
+            finally:
+                writer.close()
+            if(self.__callBackFionished is not None):
+                self.__dispatcher.finished(self.__callBackFionished, self.__fileName)
+            return self.__savePath
+        finally:
+            for queue in self.__listeners:
+                queue.put_nowait(None)
+
+    async def __request(self):
+        """发送GET请求, 返回(reader, writer, 响应头); 响应头的名称都转为小写"""
+        url = urlsplit(self.__url)
+        isHttps = url.scheme == "https"
+        port = url.port or (443 if isHttps else 80)
+        reader, writer = await asyncio.open_connection(url.hostname, port,
+                                                       ssl=ssl.create_default_context() if isHttps else None)
+        path = (url.path or "/") + ("?" + url.query if url.query else "")
+        writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n" % (path, url.netloc)).encode("latin-1"))
+        statusLine = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if(line in (b"\r\n", b"\n", b"")):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if(len(statusLine) < 2 or statusLine[1] != "200"):
+            writer.close()
+            raise IOError("下载失败, 服务器返回:%s" % " ".join(statusLine[1:]))
+        return reader, writer, headers
+
+    async def __readBody(self, reader, headers):
+        """按Content-Length、分块编码(chunked)或读到连接关闭的方式读取响应体"""
+        if(headers.get("transfer-encoding", "").lower() == "chunked"):
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if(size == 0):
+                    return
+                while size > 0:
+                    chunk = await reader.read(min(size, self.CHUNK_SIZE))
+                    if not chunk:
+                        raise IOError("连接意外断开")
+                    size -= len(chunk)
+                    yield chunk
+                await reader.readline()
+        remaining = int(headers["content-length"]) if "content-length" in headers else None
+        while remaining is None or remaining > 0:
+            chunk = await reader.read(self.CHUNK_SIZE if remaining is None else min(remaining, self.CHUNK_SIZE))
+            if not chunk:
+                return
+            if(remaining is not None):
+                remaining -= len(chunk)
+            yield chunk
+
+    def getProgress(self):
+        """当前的下载进度(DownloadProgress), 还没有开始下载时返回None"""
+        return self.__progress.getProgress() if self.__progress is not None else None
+
+    def __notify(self, event):
+        if(self.__callbackProgress is not None):
+            self.__dispatcher.progress(self.__callbackProgress, event.fileName, event.readSize, event.totalSize)
+        for queue in self.__listeners:
+            queue.put_nowait(event)
+
 
 # Test
 #=======================================================================================================================
@@ -240,9 +1184,404 @@ def testFilter():
 
 
 
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+# 引入Http服务模块, 在本地模拟下载服务器
+import functools
+# 引入函数工具模块, 用于给请求处理类绑定目录参数
+import tempfile
+# 引入临时文件模块, 测试数据放在临时目录中
+from contextlib import contextmanager
+# 引入上下文管理器装饰器, 保证测试结束后关闭服务器并删除临时目录
+
+class RangeHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """支持Range请求(单个区间)和If-Range的静态文件服务, 用于在本地测试下载"""
+
+    def send_head(self):
+        rangeHeader = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if(rangeHeader is None or not rangeHeader.startswith("bytes=") or "," in rangeHeader
+                or not os.path.isfile(path)):
+            return super().send_head()
+        stat = os.stat(path)
+        fileSize = stat.st_size
+        etag = '"%x-%x"' % (stat.st_mtime_ns, fileSize)
+        lastModified = self.date_time_string(int(stat.st_mtime))
+        # If-Range与当前文件不符时返回整个文件
+        ifRange = self.headers.get("If-Range")
+        if(ifRange is not None and ifRange not in (etag, lastModified)):
+            return super().send_head()
+        first, last = rangeHeader[len("bytes="):].split("-")
+        if(first):
+            start = int(first)
+            end = min(int(last), fileSize - 1) if last else fileSize - 1
+        else:
+            # bytes=-N表示最后N个字节
+            start = max(fileSize - int(last), 0)
+            end = fileSize - 1
+        if(start >= fileSize or start > end):
+            self.send_error(416)
+            return None
+        file = open(path, "rb")
+        file.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, fileSize))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", lastModified)
+        self.end_headers()
+        self.__remaining = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "_RangeHTTPRequestHandler__remaining", None)
+        if(remaining is None):
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            data = source.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    # 加大监听队列, 同时发起几百个连接时不会被拒绝
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def startLocalServer(directory):
+    """在后台线程中启动本地的下载服务器, 返回(服务器, 根地址)"""
+    server = LocalHTTPServer(("127.0.0.1", 0), functools.partial(RangeHTTPRequestHandler, directory=directory))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+@contextmanager
+def localDownloadServer(files):
+    """在临时目录中生成随机内容的文件并启动本地的下载服务器, 返回(目录, 根地址)
+    files为{文件名: 大小}; 退出时关闭服务器并删除临时目录"""
+    blockSize = 16 * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        for fileName, size in files.items():
+            with open(os.path.join(directory, fileName), "wb") as file:
+                for offset in range(0, size, blockSize):
+                    file.write(os.urandom(min(blockSize, size - offset)))
+        server, baseUrl = startLocalServer(directory)
+        try:
+            yield directory, baseUrl
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def isSameFile(path1, path2):
+    with open(path1, "rb") as file1, open(path2, "rb") as file2:
+        return file1.read() == file2.read()
+
+
+def testSegmentedDownload():
+    def downloadProgress(fileName, readSize, totalSize):
+        pass
+
+    def downloadFinished(fileName):
+        print("[下载%s] 文件下载完成！" % fileName)
+
+    with localDownloadServer({"TestForDownload.bin": 64 * 1024 * 1024}) as (directory, baseUrl):
+        for numOfSegments in (1, 4):
+            savePath = os.path.join(directory, "Download%d.bin" % numOfSegments)
+            download = DownloadThread("分%d段" % numOfSegments, baseUrl + "TestForDownload.bin", savePath,
+                                      downloadProgress, downloadFinished, numOfSegments)
+            start = time.perf_counter()
+            download.start()
+            download.join()
+            elapsed = time.perf_counter() - start
+            print("分%d段: 耗时%.2fs  内容一致:%s"
+                  % (numOfSegments, elapsed, isSameFile(savePath, os.path.join(directory, "TestForDownload.bin"))))
+
+
+def testResumableDownload():
+    def interruptAtHalf(fileName, readSize, totalSize):
+        """模拟下载到一半时进程退出"""
+        if(readSize > totalSize // 2):
+            raise RuntimeError("下载中断")
+
+    def downloadFinished(fileName):
+        print("[下载%s] 文件下载完成！" % fileName)
+
+    with localDownloadServer({"TestForDownload.bin": 8 * 1024 * 1024}) as (directory, baseUrl):
+        savePath = os.path.join(directory, "Download.bin")
+        download = DownloadThread("第一次", baseUrl + "TestForDownload.bin", savePath, interruptAtHalf,
+                                  downloadFinished, 4, resumable=True)
+        download.CHUNK_SIZE = 64 * 1024
+        download.CHECKPOINT_INTERVAL = 0
+        download.PROGRESS_STEP = 1
+        download.start()
+        download.join()
+        print("中断后的断点文件:", os.path.exists(savePath + ".checkpoint"))
+
+        download = DownloadThread("第二次", baseUrl + "TestForDownload.bin", savePath, lambda *args: None,
+                                  downloadFinished, 4, resumable=True)
+        download.start()
+        download.join()
+        print("内容一致:%s  断点文件已删除:%s" % (isSameFile(savePath, os.path.join(directory, "TestForDownload.bin")),
+                                           not os.path.exists(savePath + ".checkpoint")))
+
+
+def testDownloadManager():
+    import threading
+    finishedFiles = []
+    maxThreads = [threading.active_count()]
+
+    def downloadProgress(fileName, readSize, totalSize):
+        maxThreads[0] = max(maxThreads[0], threading.active_count())
+
+    def downloadFinished(fileName):
+        finishedFiles.append(fileName)
+
+    files = {"File%d.bin" % i: 16 * 1024 for i in range(0, 1000)}
+    with localDownloadServer(files) as (directory, baseUrl):
+        manager = DownloadManager(maxWorkers=8, maxPerHost=4)
+        for i in range(0, 1000):
+            # 前10个文件优先下载
+            manager.addDownload("File%d" % i, baseUrl + "File%d.bin" % i, os.path.join(directory, "Download%d.bin" % i),
+                                downloadProgress, downloadFinished, priority=1 if i < 10 else 0)
+        manager.shutdown()
+    print("完成%d个下载, 最多同时有%d个线程(含下载服务器的线程), 最先完成的文件:%s"
+          % (len(finishedFiles), maxThreads[0], finishedFiles[:3]))
+
+
+def testAsyncDownload():
+    def downloadFinished(fileName):
+        print("[下载%s] 文件下载完成！" % fileName)
+
+    async def main(directory, baseUrl):
+        # 回调方式
+        await AsyncDownload("回调", baseUrl + "TestForDownload.bin", os.path.join(directory, "Download1.bin"),
+                            lambda fileName, readSize, totalSize: None, downloadFinished)
+        # 异步迭代器方式
+        download = AsyncDownload("迭代器", baseUrl + "TestForDownload.bin", os.path.join(directory, "Download2.bin"))
+        numOfEvents = 0
+        async for event in download.events():
+            numOfEvents += 1
+        print("收到%d个进度事件, 最后一个:%d/%d" % (numOfEvents, event.readSize, event.totalSize))
+        print("保存到:%s" % await download)
+
+    with localDownloadServer({"TestForDownload.bin": 4 * 1024 * 1024}) as (directory, baseUrl):
+        asyncio.run(main(directory, baseUrl))
+
+
+def testAsyncDownloadPerformance():
+    """比较每个下载一个线程和所有下载共用一个事件循环, 同时下载500个文件的耗时和线程数"""
+    import threading
+    numOfFiles = 500
+    maxThreads = [0]
+
+    def downloadProgress(fileName, readSize, totalSize):
+        maxThreads[0] = max(maxThreads[0], threading.active_count())
+
+    def downloadFinished(fileName):
+        pass
+
+    def useThreads(directory, baseUrl):
+        downloads = [DownloadThread("File%d" % i, baseUrl + "File%d.bin" % i, os.path.join(directory, "Thread%d.bin" % i),
+                                    downloadProgress, downloadFinished) for i in range(0, numOfFiles)]
+        for download in downloads:
+            download.start()
+        for download in downloads:
+            download.join()
+
+    def useEventLoop(directory, baseUrl):
+        async def main():
+            await asyncio.gather(*[AsyncDownload("File%d" % i, baseUrl + "File%d.bin" % i,
+                                                 os.path.join(directory, "Async%d.bin" % i),
+                                                 downloadProgress, downloadFinished) for i in range(0, numOfFiles)])
+        asyncio.run(main())
+
+    results = []
+    files = {"File%d.bin" % i: 256 * 1024 for i in range(0, numOfFiles)}
+    with localDownloadServer(files) as (directory, baseUrl):
+        for name, run in (("每个下载一个线程", useThreads), ("共用一个事件循环", useEventLoop)):
+            maxThreads[0] = 0
+            start, cpuStart = time.perf_counter(), time.process_time()
+            run(directory, baseUrl)
+            results.append((name, time.perf_counter() - start, time.process_time() - cpuStart, maxThreads[0]))
+    for name, elapsed, cpu, threads in results:
+        print("%s: 耗时%.2fs  CPU时间%.2fs  最多%d个线程(含下载服务器的线程)" % (name, elapsed, cpu, threads))
+
+
+def testProgressReporter():
+    from http.server import BaseHTTPRequestHandler
+    size = 32 * 1024 * 1024
+
+    class NoLengthHandler(BaseHTTPRequestHandler):
+        """不返回Content-Length, 发送完后关闭连接"""
+
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            for i in range(0, 64):
+                self.wfile.write(bytes(64 * 1024))
+
+        def log_message(self, format, *args):
+            pass
+
+    with localDownloadServer({"TestForDownload.bin": size}) as (directory, baseUrl):
+        for interval, step in ((0.1, None), (None, 10)):
+            progresses = []
+            download = DownloadThread("间隔%s步长%s" % (interval, step), baseUrl + "TestForDownload.bin",
+                                      os.path.join(directory, "Download.bin"),
+                                      lambda *args: progresses.append(args), lambda fileName: None)
+            # 用很小的数据块模拟大量的回调
+            download.CHUNK_SIZE = 1024
+            download.ADAPTIVE_CHUNK = False
+            download.PROGRESS_INTERVAL, download.PROGRESS_STEP = interval, step
+            download.run()
+            progress = download.getProgress()
+            print("%d个数据块, 回调%d次, 最后的进度:%d/%d, 速度:%.1fMB/s"
+                  % (size // 1024, len(progresses), progresses[-1][1], progresses[-1][2], progress.speed / 1024 / 1024))
+
+        noLengthServer = LocalHTTPServer(("127.0.0.1", 0), NoLengthHandler)
+        Thread(target=noLengthServer.serve_forever, daemon=True).start()
+        try:
+            progresses = []
+            download = DownloadThread("大小未知", "http://127.0.0.1:%d/" % noLengthServer.server_address[1],
+                                      os.path.join(directory, "NoLength.bin"), lambda *args: progresses.append(args),
+                                      lambda fileName: None)
+            download.run()
+            print("大小未知时的进度:%s  最后的进度:%d/%d" % (progresses[0][1:], progresses[-1][1], progresses[-1][2]))
+        finally:
+            noLengthServer.shutdown()
+            noLengthServer.server_close()
+
+    # 每次update的开销
+    reporter = ProgressReporter("开销", 10 ** 9, lambda progress: None)
+    start = time.perf_counter()
+    for i in range(0, 1000000):
+        reporter.update(1)
+    print("每次update的耗时:%.0fns" % ((time.perf_counter() - start) * 1000))
+
+
+def testDownloadCpuCost():
+    """比较每GB数据消耗的CPU时间: 原来的iter_content固定512KB, 现在的readinto复用缓冲区并自动调整大小, 以及本地文件的sendfile"""
+    import pathlib
+    size = 256 * 1024 * 1024
+
+    def iterContent(url, savePath):
+        r = requests.get(url, stream=True)
+        with open(savePath, "wb") as file:
+            for chunk in r.iter_content(chunk_size=DownloadThread.CHUNK_SIZE):
+                if chunk:
+                    file.write(chunk)
+
+    def readInto(url, savePath):
+        DownloadThread("TestForDownload", url, savePath, lambda *args: None, lambda fileName: None).run()
+
+    with localDownloadServer({"TestForDownload.bin": size}) as (directory, baseUrl):
+        sourcePath = os.path.join(directory, "TestForDownload.bin")
+        savePath = os.path.join(directory, "Download.bin")
+        # 下载服务器在同一个进程中, 只统计下载线程的CPU时间
+        for name, run, url in (("iter_content", iterContent, baseUrl + "TestForDownload.bin"),
+                               ("readinto", readInto, baseUrl + "TestForDownload.bin"),
+                               ("sendfile", readInto, pathlib.Path(sourcePath).as_uri())):
+            start, cpuStart = time.perf_counter(), time.thread_time()
+            run(url, savePath)
+            elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpuStart
+            print("%-12s: 耗时%.2fs  每GB的CPU时间%.2fs" % (name, elapsed, cpu * 1024 * 1024 * 1024 / size))
+
+
+def testBandwidthLimiter():
+    mb = 1024 * 1024
+    with localDownloadServer({"TestForDownload.bin": 8 * mb}) as (directory, baseUrl):
+        url = baseUrl + "TestForDownload.bin"
+
+        def newDownload(fileName, throttle, callBackFinished=lambda fileName: None):
+            return DownloadThread(fileName, url, os.path.join(directory, fileName + ".bin"), lambda *args: None,
+                                  callBackFinished, throttle=throttle)
+
+        # 单个下载限速2MB/s
+        download = newDownload("单个限速", Throttle(2 * mb))
+        start = time.perf_counter()
+        download.run()
+        print("单个下载限速2.0MB/s, 实际:%.2fMB/s" % (8 / (time.perf_counter() - start)))
+
+        # 全局限速4MB/s, 交互下载的权重为3, 后台同步的权重为1
+        limiter = BandwidthLimiter(4 * mb)
+        background = newDownload("后台同步", limiter.throttle(weight=1))
+        results = {}
+
+        def interactiveFinished(fileName):
+            results["time"] = time.perf_counter() - start
+            results["background"] = background.getProgress().readSize
+
+        interactive = newDownload("交互下载", limiter.throttle(weight=3), interactiveFinished)
+        start = time.perf_counter()
+        background.start()
+        interactive.start()
+        interactive.join()
+        background.join()
+        total = time.perf_counter() - start
+    print("全局限速4.0MB/s, 同时下载时 交互下载:%.2fMB/s 后台同步:%.2fMB/s(期望3:1); 总体:%.2fMB/s"
+          % (8 / results["time"], results["background"] / mb / results["time"], 16 / total))
+
+
+def testCallbackDispatcher():
+    import threading, random
+
+    def slowProgress(fileName, readSize, totalSize):
+        """模拟很慢的界面刷新"""
+        time.sleep(0.02)
+
+    # 事件循环: 回调在事件循环的线程中执行
+    async def main(url, savePath):
+        loop = asyncio.get_running_loop()
+        threadNames = set()
+        dispatcher = AsyncioDispatcher(loop)
+        download = DownloadThread("事件循环", url, savePath,
+                                  lambda *args: threadNames.add(threading.current_thread().name),
+                                  lambda fileName: threadNames.add(threading.current_thread().name), dispatcher=dispatcher)
+        await loop.run_in_executor(None, download.run)
+        await asyncio.sleep(0)
+        print("事件循环: 回调所在的线程:%s" % threadNames)
+
+    with localDownloadServer({"TestForDownload.bin": 32 * 1024 * 1024}) as (directory, baseUrl):
+        url = baseUrl + "TestForDownload.bin"
+        savePath = os.path.join(directory, "Download.bin")
+        for name, dispatcher in (("直接调用", InlineDispatcher()), ("专门的线程", ThreadDispatcher(maxQueueSize=8))):
+            download = DownloadThread(name, url, savePath, slowProgress, lambda fileName: None, dispatcher=dispatcher)
+            download.CHUNK_SIZE = 64 * 1024
+            download.ADAPTIVE_CHUNK = False
+            download.PROGRESS_STEP = 0.5
+            start = time.perf_counter()
+            download.run()
+            elapsed = time.perf_counter() - start
+            dispatcher.close()
+            print("%s: 下载耗时%.2fs  丢弃的进度事件:%d" % (name, elapsed, dispatcher.getNumOfDropped()))
+
+        # 线程池: 完成回调执行得有快有慢, 仍然按派发的顺序执行
+        finishedOrder = []
+        dispatcher = ThreadPoolDispatcher(numOfWorkers=4, maxQueueSize=16)
+        for i in range(0, 100):
+            dispatcher.progress(slowProgress, "File%d" % i, 0, 1)
+            dispatcher.finished(lambda i: (time.sleep(random.random() / 1000), finishedOrder.append(i)), i)
+        dispatcher.close()
+        print("线程池: 完成回调按顺序执行:%s  丢弃的进度事件:%d"
+              % (finishedOrder == list(range(0, 100)), dispatcher.getNumOfDropped()))
+
+        asyncio.run(main(url, savePath))
+
+
 def testDownload():
     def downloadProgress(fileName, readSize, totalSize):
         """定义下载进度的回调函数"""
+        if(totalSize is None):
+            print("[下载%s] 已下载:%d字节" % (fileName, readSize))
+            return
         percent = (readSize / totalSize) * 100
         print("[下载%s] 下载进度:%.2f%%" % (fileName, percent))
 
@@ -270,3 +1609,12 @@ def testDownload():
 
 
 testDownload()
+# testSegmentedDownload()
+# testResumableDownload()
+# testDownloadManager()
+# testAsyncDownload()
+# testAsyncDownloadPerformance()
+# testProgressReporter()
+# testDownloadCpuCost()
+# testBandwidthLimiter()
+# testCallbackDispatcher()
@@ -20,103 +20,612 @@
 #==============================
 from abc import ABCMeta, abstractmethod
 # 引入ABCMeta和abstractmethod来定义抽象类和抽象方法
+from itertools import islice
+# 引入islice, 用于将数据流切分成小块
+import time
+# 引入时间模块, 用于统计过滤器的耗时
 
 class Filter(metaclass=ABCMeta):
     """过滤器"""
 
+    """流式过滤时每一块的元素个数"""
+    ChunkSize = 1000
+    """处理每个元素的估计耗时(相对值), 供过滤器链优化执行顺序"""
+    EstimatedCost = 1.0
+    """估计的选择率: 过滤后剩余元素的比例"""
+    EstimatedSelectivity = 1.0
+    # 过滤器的版本号, 过滤规则被修改时加1
+    _version = 0
+
     @abstractmethod
     def doFilter(self, elements):
         """过滤方法"""
         pass
 
+    def getVersion(self):
+        """版本号, 只用于判断过滤规则是否变化过"""
+        return self._version
+
+    def doFilterEach(self, elements):
+        """批量过滤, 返回每个元素各自的结果(元组, 被过滤掉时为空元组)
+        要求元素之间互不影响, 且每个元素最多输出一个元素
+        默认整批调用一次doFilter, 有元素被过滤掉时结果对不上号, 对半拆开分别处理"""
+        newElements = self.doFilter(elements)
+        if(len(newElements) == len(elements)):
+            return [(element,) for element in newElements]
+        if(len(elements) == 1):
+            return [tuple(newElements)]
+        middle = len(elements) // 2
+        return self.doFilterEach(elements[:middle]) + self.doFilterEach(elements[middle:])
+
+    def filterStream(self, elements):
+        """流式过滤: 输入和输出都是迭代器, 内存占用与输入的长度无关
+        默认每次取ChunkSize个元素调用doFilter, 能逐个处理元素的子类可重写该方法"""
+        iterator = iter(elements)
+        chunk = list(islice(iterator, self.ChunkSize))
+        while chunk:
+            yield from self.doFilter(chunk)
+            chunk = list(islice(iterator, self.ChunkSize))
+
 
 class FilterChain(Filter):
     """过滤器链"""
 
     def __init__(self):
         self._filters = []
+        # 过滤器链的版本号, 增删过滤器时加1
+        self._version = 0
 
     def addFilter(self, filter):
         self._filters.append(filter)
+        self._version += 1
 
     def removeFilter(self, filter):
         self._filters.remove(filter)
+        self._version += 1
+
+    def getVersion(self):
+        """增删过滤器, 或者其中的过滤器被修改时, 版本号都会变化"""
+        return (self._version,) + tuple(filter.getVersion() for filter in self._filters)
 
     def doFilter(self, elements):
         for filter in self._filters:
             elements = filter.doFilter(elements)
         return elements
 
+    def doFilterEach(self, elements):
+        """每个过滤器整批处理一次, 同时记下剩余元素在输入中的位置"""
+        eachResults = [()] * len(elements)
+        indices = range(0, len(elements))
+        for filter in self._filters:
+            if(isinstance(filter, RewriteFilter)):
+                # 改写过滤器不增减元素, 位置不变
+                elements = filter.doFilter(elements)
+                continue
+            results = filter.doFilterEach(elements)
+            indices = [index for index, result in zip(indices, results) if result]
+            elements = [result[0] for result in results if result]
+        for index, element in zip(indices, elements):
+            eachResults[index] = (element,)
+        return eachResults
+
+    def filterStream(self, elements):
+        """将所有过滤器串成一条惰性的流水线, 元素逐个(或逐块)流过每一个过滤器"""
+        for filter in self._filters:
+            elements = filter.filterStream(elements)
+        return iter(elements)
+
+
+class PredicateFilter(Filter):
+    """条件过滤器: 只去掉不满足条件的元素, 不修改元素; 相邻的条件过滤器可以交换顺序"""
+
+    @abstractmethod
+    def accept(self, element):
+        """元素是否保留"""
+        pass
+
+    def doFilter(self, elements):
+        return [element for element in elements if self.accept(element)]
+
+    def doFilterEach(self, elements):
+        return [(element,) if self.accept(element) else () for element in elements]
+
+    def filterStream(self, elements):
+        for element in elements:
+            if(self.accept(element)):
+                yield element
+
+
+class RewriteFilter(Filter):
+    """改写过滤器: 逐个改写元素的内容, 不增减元素; 相邻的改写过滤器可以合并成一次遍历"""
+
+    @abstractmethod
+    def rewrite(self, element):
+        """改写一个元素"""
+        pass
+
+    def doFilter(self, elements):
+        return [self.rewrite(element) for element in elements]
+
+    def doFilterEach(self, elements):
+        return [(self.rewrite(element),) for element in elements]
+
+    def filterStream(self, elements):
+        for element in elements:
+            yield self.rewrite(element)
+
+
+class FusedRewriteFilter(RewriteFilter):
+    """由多个相邻的改写过滤器合并而成, 每个元素只遍历一次"""
+
+    def __init__(self, filters):
+        self.__filters = filters
+        self.__rewriters = [filter.rewrite for filter in filters]
+
+    def getFilters(self):
+        return self.__filters
+
+    def rewrite(self, element):
+        for rewriter in self.__rewriters:
+            element = rewriter(element)
+        return element
+
+
+class OptimizedFilterChain(FilterChain):
+    """会优化执行计划的过滤器链
+    1. 相邻的条件过滤器按 耗时/(1-选择率) 从小到大排序, 便宜又能过滤掉很多元素的过滤器先执行;
+    2. 相邻的改写过滤器合并成一次遍历;
+    耗时和选择率先用过滤器声明的估计值, 一组中的过滤器都处理过MinSamples个元素后整组改用实测值;
+    估计的耗时是相对值, 实测的耗时是秒, 两者不能放在一起比较"""
+
+    """使用实测值之前最少需要处理的元素个数"""
+    MinSamples = 1000
+
+    def __init__(self):
+        super().__init__()
+        # 每个条件过滤器的实测数据: [输入元素个数, 输出元素个数, 总耗时]
+        self.__statistics = {}
+
+    def doFilter(self, elements):
+        for stage in self.getPlan():
+            if(isinstance(stage, list)):
+                for filter in stage:
+                    elements = self.__runMeasured(filter, elements)
+            else:
+                elements = stage.doFilter(elements)
+        return elements
+
+    def getPlan(self):
+        """执行计划: 排好序的条件过滤器组(list)、合并后的改写过滤器和其他过滤器"""
+        plan = []
+        for filter in self._filters:
+            last = plan[-1] if plan else None
+            if(isinstance(filter, PredicateFilter)):
+                if(isinstance(last, list)):
+                    last.append(filter)
+                else:
+                    plan.append([filter])
+            elif(isinstance(filter, RewriteFilter)):
+                if(isinstance(last, RewriteFilter)):
+                    previous = last.getFilters() if isinstance(last, FusedRewriteFilter) else [last]
+                    plan[-1] = FusedRewriteFilter(previous + [filter])
+                else:
+                    plan.append(filter)
+            else:
+                plan.append(filter)
+        for stage in plan:
+            if(isinstance(stage, list)):
+                estimates = self.getGroupEstimates(stage)
+                stage.sort(key=lambda filter: self.__getRank(estimates[filter]))
+        return plan
+
+    def explain(self):
+        """输出执行计划"""
+        lines = []
+        for i, stage in enumerate(self.getPlan()):
+            if(isinstance(stage, list)):
+                lines.append("%d. 条件过滤(按代价排序):" % (i + 1))
+                estimates = self.getGroupEstimates(stage)
+                for filter in stage:
+                    cost, selectivity, isMeasured = estimates[filter]
+                    lines.append("     %s  耗时:%.3g  选择率:%.2f  (%s)"
+                                 % (type(filter).__name__, cost, selectivity, "实测" if isMeasured else "估计"))
+            elif(isinstance(stage, FusedRewriteFilter)):
+                lines.append("%d. 合并改写(一次遍历): %s"
+                             % (i + 1, " -> ".join(type(filter).__name__ for filter in stage.getFilters())))
+            else:
+                lines.append("%d. %s" % (i + 1, type(stage).__name__))
+        return "\n".join(lines)
+
+    def getEstimates(self, filter):
+        """返回(每个元素的耗时, 选择率, 是否为实测值)"""
+        statistics = self.__statistics.get(filter)
+        if(statistics is not None and statistics[0] >= self.MinSamples):
+            numIn, numOut, totalTime = statistics
+            return totalTime / numIn, numOut / numIn, True
+        return filter.EstimatedCost, filter.EstimatedSelectivity, False
+
+    def getGroupEstimates(self, filters):
+        """返回一组条件过滤器的{过滤器: (耗时, 选择率, 是否为实测值)}
+        只有整组都有实测值时才使用实测值, 否则整组都用估计值, 保证排序时比较的是同一种单位"""
+        estimates = {filter: self.getEstimates(filter) for filter in filters}
+        if(not all(isMeasured for cost, selectivity, isMeasured in estimates.values())):
+            estimates = {filter: (filter.EstimatedCost, filter.EstimatedSelectivity, False) for filter in filters}
+        return estimates
+
+    def __getRank(self, estimates):
+        cost, selectivity, isMeasured = estimates
+        # 不能过滤掉任何元素的过滤器放在最后
+        return cost / (1 - selectivity) if selectivity < 1 else float("inf")
+
+    def __runMeasured(self, filter, elements):
+        start = time.perf_counter()
+        newElements = filter.doFilter(elements)
+        statistics = self.__statistics.setdefault(filter, [0, 0, 0.0])
+        statistics[0] += len(elements)
+        statistics[1] += len(newElements)
+        statistics[2] += time.perf_counter() - start
+        return newElements
+
+
+# 带结果缓存的过滤器链
+#==============================
+from collections import OrderedDict
+# 引入有序字典, 用于实现LRU缓存
+
+class CachedFilterChain(Filter):
+    """在过滤器链前面加一层LRU缓存, 相同的内容只过滤一次
+    要求过滤器链逐个独立地处理元素(一个元素的结果与其他元素无关), 且每个元素最多输出一个元素;
+    未命中的元素攒成一批, 调用一次过滤器链的doFilterEach; 缓存以内容为键(由dict计算内容的哈希), 过滤器链的版本号变化(增删过滤器或修改过滤器)时自动清空"""
+
+    def __init__(self, filterChain, maxSize=10000):
+        self.__filterChain = filterChain
+        self.__maxSize = maxSize
+        # 内容 -> 过滤结果(元组, 被过滤掉时为空元组)
+        self.__cache = OrderedDict()
+        self.__version = filterChain.getVersion()
+        self.__numOfHits = 0
+        self.__numOfMisses = 0
+        self.__numOfEvictions = 0
+
+    def doFilter(self, elements):
+        if(self.__version != self.__filterChain.getVersion()):
+            self.clearCache()
+            self.__version = self.__filterChain.getVersion()
+        cache = self.__cache
+        results = [cache.get(element) for element in elements]
+        # 命中的元素移到最近使用的一端
+        for element, result in zip(elements, results):
+            if(result is not None):
+                cache.move_to_end(element)
+        # 未命中的元素(去重后)一起过滤
+        misses = list(dict.fromkeys(element for element, result in zip(elements, results) if result is None))
+        self.__numOfHits += len(elements) - len(misses)
+        self.__numOfMisses += len(misses)
+        if(not misses):
+            return [newElement for result in results for newElement in result]
+        missResults = dict(zip(misses, self.__filterChain.doFilterEach(misses)))
+        # 新的结果超过容量时, 只有最后maxSize个能留下, 前面的不必放入
+        numOfSkipped = max(len(misses) - self.__maxSize, 0)
+        for element in misses[numOfSkipped:]:
+            cache[element] = missResults[element]
+        self.__numOfEvictions += numOfSkipped
+        while len(cache) > self.__maxSize:
+            cache.popitem(last=False)
+            self.__numOfEvictions += 1
+        return [newElement for element, result in zip(elements, results)
+                for newElement in (result if result is not None else missResults[element])]
+
+    def getVersion(self):
+        return self.__filterChain.getVersion()
+
+    def clearCache(self):
+        self.__cache.clear()
+
+    def getCacheStatistics(self):
+        """缓存的命中次数、未命中次数、淘汰次数、当前大小和命中率"""
+        numOfRequests = self.__numOfHits + self.__numOfMisses
+        return {
+            "hits": self.__numOfHits,
+            "misses": self.__numOfMisses,
+            "evictions": self.__numOfEvictions,
+            "size": len(self.__cache),
+            "hitRate": self.__numOfHits / numOfRequests if numOfRequests > 0 else 0.0,
+        }
+
+
+# 多进程并行的过滤器链
+#==============================
+from concurrent.futures import ProcessPoolExecutor
+# 引入进程池
+
+# 工作进程中的过滤器链, 在工作进程启动时传入一次, 之后每个任务只传递数据
+_workerFilterChain = None
+
+def _initFilterWorker(filterChain):
+    global _workerFilterChain
+    _workerFilterChain = filterChain
+
+def _filterChunk(elements):
+    return _workerFilterChain.doFilter(elements)
+
+def _filterChunkEach(elements):
+    return _workerFilterChain.doFilterEach(elements)
+
+
+class ParallelFilterChain(FilterChain):
+    """多进程并行的过滤器链
+    将输入切分成多块, 每一块在进程池中跑完整条过滤器链; 进程池会被复用, 输出保持输入的顺序
+    工作进程持有过滤器链的副本, 版本号变化(增删过滤器或修改过滤器)后重新创建进程池"""
+
+    def __init__(self, maxWorkers=None, chunkSize=10000):
+        super().__init__()
+        self.__maxWorkers = maxWorkers
+        self.__chunkSize = chunkSize
+        self.__executor = None
+        # 工作进程中的过滤器链对应的版本号
+        self.__executorVersion = None
+
+    def doFilter(self, elements):
+        return self.__map(_filterChunk, elements)
+
+    def doFilterEach(self, elements):
+        return self.__map(_filterChunkEach, elements)
+
+    def shutdown(self):
+        """关闭进程池"""
+        if(self.__executor is not None):
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def __map(self, function, elements):
+        """在进程池中对每一块调用function, 按输入的顺序拼接结果"""
+        version = self.getVersion()
+        if(self.__executor is not None and self.__executorVersion != version):
+            self.shutdown()
+        if(self.__executor is None):
+            filterChain = FilterChain()
+            for filter in self._filters:
+                filterChain.addFilter(filter)
+            self.__executor = ProcessPoolExecutor(max_workers=self.__maxWorkers, initializer=_initFilterWorker,
+                                                  initargs=(filterChain,))
+            self.__executorVersion = version
+        chunks = [elements[i:i + self.__chunkSize] for i in range(0, len(elements), self.__chunkSize)]
+        newElements = []
+        # map按提交的顺序返回结果
+        for chunk in self.__executor.map(function, chunks):
+            newElements.extend(chunk)
+        return newElements
+
 
 # 基于框架的实现
 #==============================
-class FilterScreen(Filter):
+class FilterScreen(PredicateFilter):
     """过滤网"""
 
-    def doFilter(self, elements):
-        for material in elements:
-            if (material == "豆渣"):
-                elements.remove(material)
-        return elements
+    EstimatedSelectivity = 0.5
+
+    def accept(self, material):
+        return material != "豆渣"
+
+    def doFilterBulk(self, materials):
+        """批量模式: materials为NumPy数组(或可以转换成数组的列数据), 用布尔掩码一次过滤, 返回NumPy数组"""
+        import numpy as np
+        # 引入NumPy, 只有批量模式需要
+        materials = np.asarray(materials)
+        return materials[materials != "豆渣"]
 
 
 import re
 # 引入正则表达式库
-
-class SensitiveFilter(Filter):
+import json
+# 引入JSON模块, 用于将编译好的自动机保存到磁盘(不用pickle, 加载文件时不会执行其中的代码)
+from collections import deque
+# 引入双端队列, 用于广度优先地构建失败指针
+
+class AhoCorasickAutomaton:
+    """Aho-Corasick多模式匹配自动机
+    所有词语构成一棵字典树, 每个节点的失败指针指向其最长的、也在树中的后缀,
+    一次线性扫描就能找出文本中所有词语的出现位置; 增删词语后在下次匹配前重建失败指针"""
+
+    def __init__(self, words=()):
+        # 节点的转移表、失败指针, 以及以该节点结尾的最长词语的长度(0表示不是词语的结尾)
+        self.__goto = [{}]
+        self.__fail = [0]
+        self.__wordLength = [0]
+        # 考虑失败指针后, 在该节点结尾的最长词语的长度
+        self.__matchLength = [0]
+        self.__words = set()
+        self.__isDirty = False
+        for word in words:
+            self.addWord(word)
+
+    def addWord(self, word):
+        if(not word or word in self.__words):
+            return
+        node = 0
+        for char in word:
+            nextNode = self.__goto[node].get(char)
+            if(nextNode is None):
+                nextNode = len(self.__goto)
+                self.__goto[node][char] = nextNode
+                self.__goto.append({})
+                self.__fail.append(0)
+                self.__wordLength.append(0)
+                self.__matchLength.append(0)
+            node = nextNode
+        self.__wordLength[node] = len(word)
+        self.__words.add(word)
+        self.__isDirty = True
+
+    def removeWord(self, word):
+        """删除词语, 字典树的节点保留, 只去掉词语结尾的标记"""
+        if(word not in self.__words):
+            return
+        node = 0
+        for char in word:
+            node = self.__goto[node][char]
+        self.__wordLength[node] = 0
+        self.__words.discard(word)
+        self.__isDirty = True
+
+    def getWords(self):
+        return set(self.__words)
+
+    def removeAll(self, text):
+        """删除文本中出现的所有词语(重叠的出现也会全部删除)"""
+        if(self.__isDirty):
+            self.__build()
+        goto = self.__goto
+        fail = self.__fail
+        matchLength = self.__matchLength
+        # 用差分数组标记需要删除的区间, 整个过程是线性的
+        marks = None
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            length = matchLength[node]
+            if(length):
+                if(marks is None):
+                    marks = [0] * (len(text) + 1)
+                marks[i - length + 1] += 1
+                marks[i + 1] -= 1
+        if(marks is None):
+            return text
+        result = []
+        depth = 0
+        for i, char in enumerate(text):
+            depth += marks[i]
+            if(depth == 0):
+                result.append(char)
+        return "".join(result)
+
+    def saveToFile(self, filePath):
+        """将编译好的自动机保存到磁盘, 启动时直接加载, 不需要重新构建"""
+        if(self.__isDirty):
+            self.__build()
+        with open(filePath, "w", encoding="utf-8") as file:
+            json.dump({"goto": self.__goto, "fail": self.__fail, "wordLength": self.__wordLength,
+                       "matchLength": self.__matchLength, "words": sorted(self.__words)},
+                      file, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def loadFromFile(cls, filePath):
+        automaton = cls()
+        with open(filePath, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        automaton.__goto = data["goto"]
+        automaton.__fail = data["fail"]
+        automaton.__wordLength = data["wordLength"]
+        automaton.__matchLength = data["matchLength"]
+        automaton.__words = set(data["words"])
+        return automaton
+
+    def __build(self):
+        """广度优先地计算每个节点的失败指针和最长匹配长度"""
+        queue = deque()
+        for nextNode in self.__goto[0].values():
+            self.__fail[nextNode] = 0
+            self.__matchLength[nextNode] = self.__wordLength[nextNode]
+            queue.append(nextNode)
+        while queue:
+            node = queue.popleft()
+            for char, nextNode in self.__goto[node].items():
+                failNode = self.__fail[node]
+                while failNode and char not in self.__goto[failNode]:
+                    failNode = self.__fail[failNode]
+                self.__fail[nextNode] = self.__goto[failNode].get(char, 0)
+                self.__matchLength[nextNode] = max(self.__wordLength[nextNode],
+                                                   self.__matchLength[self.__fail[nextNode]])
+                queue.append(nextNode)
+        self.__isDirty = False
+
+
+class SensitiveFilter(RewriteFilter):
     """敏感词过滤"""
 
-    def __init__(self):
-        self.__sensitives = ["黄色", "台独", "贪污"]
+    EstimatedCost = 10.0
 
-    def doFilter(self, elements):
-        # 敏感词列表转换成正则表达式
-        regex = ""
-        for word in self.__sensitives:
-            regex += word + "|"
-        regex = regex[0: len(regex) - 1]
+    def __init__(self, sensitives=None, automaton=None):
+        """可以直接传入从磁盘加载的自动机, 省去构建的时间"""
+        if(automaton is None):
+            automaton = AhoCorasickAutomaton(sensitives if sensitives is not None else ["黄色", "台独", "贪污"])
+        self.__automaton = automaton
 
-        # 对每个元素进行过滤
-        newElements = []
-        for element in elements:
-            item, num = re.subn(regex, "", element)
-            newElements.append(item)
+    def addSensitive(self, word):
+        self.__automaton.addWord(word)
+        self._version += 1
 
-        return newElements
+    def removeSensitive(self, word):
+        self.__automaton.removeWord(word)
+        self._version += 1
+
+    def saveToFile(self, filePath):
+        self.__automaton.saveToFile(filePath)
+
+    def rewrite(self, element):
+        # 自动机只构建一次, 对每个元素进行一次线性扫描
+        return self.__automaton.removeAll(element)
 
 
-class HtmlFilter(Filter):
+class HtmlFilter(RewriteFilter):
     """HTML特殊字符转换"""
 
+    EstimatedCost = 2.0
+
     def __init__(self):
         self.__wordMap = {
             "&": "&amp;",
-            "'": " &apos;",
+            "'": "&apos;",
             ">": "&gt;",
             "<": "&lt;",
-            "\"": " &quot;",
+            "\"": "&quot;",
         }
+        # 转换结果中含有的字符(如&)必须最先转换, 否则会被重复转义; 排好顺序后结果与字典的顺序无关
+        # 注: CPython中str.replace是C实现的, 几次replace比str.translate或正则回调的单次扫描都快得多
+        self.__replacements = sorted(self.__wordMap.items(),
+                                     key=lambda item: not any(item[0] in value for value in self.__wordMap.values()))
 
-    def doFilter(self, elements):
-        newElements = []
-        for element in elements:
-            for key, value in self.__wordMap.items():
-                element = element.replace(key, value)
-            newElements.append(element)
-        return newElements
+    def rewrite(self, element):
+        for key, value in self.__replacements:
+            element = element.replace(key, value)
+        return element
 
 
 # Test
 #=======================================================================================================================
 
 def testFilterScreen():
-    rawMaterials = ["豆浆", "豆渣"]
+    rawMaterials = ["豆浆", "豆渣", "豆渣", "豆浆"]
     print("过滤前：", rawMaterials)
     filter = FilterScreen()
     filteredMaterials = filter.doFilter(rawMaterials)
     print("过滤后：",filteredMaterials)
 
 
+def testFilterScreenBulk(numOfMaterials=1000000):
+    import random, time
+    import numpy as np
+    random.seed(0)
+    rawMaterials = [random.choice(["豆浆", "豆渣"]) for i in range(0, numOfMaterials)]
+    filter = FilterScreen()
+    start = time.perf_counter()
+    filteredMaterials = filter.doFilter(rawMaterials)
+    print("列表模式: 耗时%.3fs  剩余%d个" % (time.perf_counter() - start, len(filteredMaterials)))
+    column = np.array(rawMaterials)
+    start = time.perf_counter()
+    filteredColumn = filter.doFilterBulk(column)
+    print("批量模式: 耗时%.3fs  剩余%d个" % (time.perf_counter() - start, len(filteredColumn)))
+
+
 
 def testFilter():
     rawMaterials = ["豆浆", "豆渣"]
@@ -142,6 +651,181 @@ def testFiltercontent():
     print("过滤后的内容：", newContents)
 
 
+def testSensitiveFilter():
+    sensitiveFilter = SensitiveFilter()
+    sensitiveFilter.addSensitive("台独活动")
+    sensitiveFilter.addSensitive("a.b")
+    contents = ["有人企图搞台独活动", "a.b不是正则表达式, axb不会被过滤", "黄色贪污"]
+    print("过滤后的内容：", sensitiveFilter.doFilter(contents))
+    sensitiveFilter.removeSensitive("贪污")
+    print("删除'贪污'后：", sensitiveFilter.doFilter(contents))
+
+    import os, tempfile
+    filePath = os.path.join(tempfile.gettempdir(), "sensitives.automaton")
+    sensitiveFilter.saveToFile(filePath)
+    loadedFilter = SensitiveFilter(automaton=AhoCorasickAutomaton.loadFromFile(filePath))
+    print("从磁盘加载后：", loadedFilter.doFilter(contents))
+    os.remove(filePath)
+
+
+def testHtmlFilterPerformance(sizeInMB=100):
+    """在sizeInMB大小的文本上比较HtmlFilter、html.escape和单次扫描的正则回调"""
+    import html, time
+    line = '有人出售黄色书：<黄情味道>, 有人企图搞台独活动, ——"造谣咨询" it\'s & more\n'
+    corpus = [line] * (sizeInMB * 1024 * 1024 // len(line.encode("utf-8")))
+    wordMap = {"&": "&amp;", "'": "&apos;", ">": "&gt;", "<": "&lt;", "\"": "&quot;"}
+    regex = re.compile("[&'<>\"]")
+
+    for name, fun in [("HtmlFilter", HtmlFilter().doFilter),
+                      ("html.escape", lambda elements: [html.escape(element) for element in elements]),
+                      ("正则回调", lambda elements: [regex.sub(lambda m: wordMap[m.group()], element)
+                                                 for element in elements])]:
+        start = time.perf_counter()
+        fun(corpus)
+        cost = time.perf_counter() - start
+        print("%-12s 耗时:%.2fs  %.1fMB/s" % (name, cost, sizeInMB / cost))
+
+
+def testFilterStream():
+    """过滤一个无限的日志流, 只取前几条"""
+    import itertools
+    logs = ("第%d条日志: <贪污>举报 & '台独'言论" % i for i in itertools.count(1))
+    filterChain = FilterChain()
+    filterChain.addFilter(SensitiveFilter())
+    filterChain.addFilter(HtmlFilter())
+    for content in itertools.islice(filterChain.filterStream(logs), 3):
+        print(content)
+
+
+def testParallelFilterChain(numOfElements=200000):
+    """比较不同进程数下敏感词过滤+HTML转换的耗时"""
+    import os, random, time
+    words = ["敏感词%d" % i for i in range(0, 10000)]
+    random.seed(0)
+    contents = ["有人出售<%s>, 有人企图搞'%s'活动 & \"%s\"" % (random.choice(words), random.choice(words), i)
+                for i in range(0, numOfElements)]
+
+    filterChain = FilterChain()
+    filterChain.addFilter(SensitiveFilter(words))
+    filterChain.addFilter(HtmlFilter())
+    start = time.perf_counter()
+    expected = filterChain.doFilter(contents)
+    serialCost = time.perf_counter() - start
+    print("单进程: 耗时%.2fs" % serialCost)
+
+    numOfCpus = os.cpu_count() or 1
+    for numOfWorkers in sorted({1, 2, 4, numOfCpus}):
+        if(numOfWorkers > numOfCpus):
+            continue
+        with ParallelFilterChain(numOfWorkers) as parallelChain:
+            parallelChain.addFilter(SensitiveFilter(words))
+            parallelChain.addFilter(HtmlFilter())
+            # 第一次调用会启动工作进程, 不计入耗时
+            parallelChain.doFilter(contents[:numOfWorkers])
+            start = time.perf_counter()
+            result = parallelChain.doFilter(contents)
+            cost = time.perf_counter() - start
+        print("%d个进程: 耗时%.2fs  加速比:%.2f  结果一致:%s" % (numOfWorkers, cost, serialCost / cost, result == expected))
+
+    # 修改过滤器后, 工作进程使用新的过滤规则
+    sensitiveFilter = SensitiveFilter(words)
+    with ParallelFilterChain(2) as parallelChain:
+        parallelChain.addFilter(sensitiveFilter)
+        print("增加敏感词之前:", parallelChain.doFilter(["abc"]))
+        sensitiveFilter.addSensitive("abc")
+        print("增加敏感词之后:", parallelChain.doFilter(["abc"]))
+
+
+def testOptimizedFilterChain(numOfElements=200000):
+    """比较按添加顺序执行和优化后执行的耗时"""
+    import random
+
+    class ContainsDigitFilter(PredicateFilter):
+        """去掉不含数字的内容, 要逐个字符检查, 耗时较多"""
+        EstimatedCost = 20.0
+        EstimatedSelectivity = 0.9
+
+        def accept(self, element):
+            return any(char.isdigit() for char in element)
+
+    class LengthFilter(PredicateFilter):
+        """去掉太短的内容, 很便宜"""
+        EstimatedSelectivity = 0.2
+
+        def accept(self, element):
+            return len(element) > 25
+
+    random.seed(0)
+    contents = ["有人出售<黄色>书%s" % ("'" * random.randint(0, 20) + (str(i) if random.random() < 0.9 else ""))
+                for i in range(0, numOfElements)]
+
+    naiveChain = FilterChain()
+    optimizedChain = OptimizedFilterChain()
+    for filterChain in (naiveChain, optimizedChain):
+        filterChain.addFilter(ContainsDigitFilter())
+        filterChain.addFilter(LengthFilter())
+        filterChain.addFilter(SensitiveFilter())
+        filterChain.addFilter(HtmlFilter())
+
+    print(optimizedChain.explain())
+    for name, filterChain in (("按添加顺序", naiveChain), ("优化后", optimizedChain)):
+        start = time.perf_counter()
+        result = filterChain.doFilter(contents)
+        print("%s: 耗时%.3fs  剩余%d个" % (name, time.perf_counter() - start, len(result)))
+    print(optimizedChain.explain())
+
+
+def testCachedFilterChain(numOfElements=200000):
+    import random
+    random.seed(0)
+    # 大量重复的标题和模板消息
+    titles = ["第%d期: 有人出售<黄色>书 & '台独'言论" % i for i in range(0, 500)]
+    contents = [random.choice(titles) for i in range(0, numOfElements)]
+
+    filterChain = FilterChain()
+    filterChain.addFilter(SensitiveFilter())
+    filterChain.addFilter(HtmlFilter())
+    cachedChain = CachedFilterChain(filterChain, 1000)
+
+    start = time.perf_counter()
+    expected = filterChain.doFilter(contents)
+    print("不使用缓存: 耗时%.3fs" % (time.perf_counter() - start))
+    start = time.perf_counter()
+    result = cachedChain.doFilter(contents)
+    print("使用缓存: 耗时%.3fs  结果一致:%s  %s" % (time.perf_counter() - start, result == expected,
+                                              cachedChain.getCacheStatistics()))
+
+    # 修改过滤器链后缓存自动失效
+    filterChain.addFilter(FilterScreen())
+    cachedChain.doFilter(contents[:10])
+    print("增加过滤器后:", cachedChain.getCacheStatistics())
+    sensitiveFilter = SensitiveFilter()
+    filterChain = FilterChain()
+    filterChain.addFilter(sensitiveFilter)
+    cachedChain = CachedFilterChain(filterChain)
+    print("增加敏感词之前:", cachedChain.doFilter(["abc"]))
+    sensitiveFilter.addSensitive("abc")
+    print("增加敏感词之后:", cachedChain.doFilter(["abc"]))
+
+    # 缓存全部未命中时, 未命中的元素一批过滤, 与不使用缓存的耗时相近
+    contents = ["第%d期: 有人出售<黄色>书 & '台独'言论" % i for i in range(0, numOfElements)]
+    filterChain = FilterChain()
+    filterChain.addFilter(SensitiveFilter())
+    filterChain.addFilter(FilterScreen())
+    filterChain.addFilter(HtmlFilter())
+    for name, filter in (("不使用缓存", filterChain), ("使用缓存(全部未命中)", CachedFilterChain(filterChain, 1000))):
+        start = time.perf_counter()
+        result = filter.doFilter(contents)
+        print("%s: 耗时%.3fs  剩余%d个" % (name, time.perf_counter() - start, len(result)))
+
+
 # testFilterScreen()
+# testFilterScreenBulk()
 # testFilter()
+# testSensitiveFilter()
+# testHtmlFilterPerformance()
+# testFilterStream()
+# testParallelFilterChain()
+# testOptimizedFilterChain()
+# testCachedFilterChain()
 testFiltercontent()
@@ -84,6 +84,10 @@ import logging
 # 引入logging模块用于输出日志信息
 import time
 # 引入时间模块
+import math
+# 引入数学模块
+from collections import deque, namedtuple
+# 引入双端队列, 用于存放空闲的池对象; 引入具名元组, 用于表示对象池事件
 logging.basicConfig(level=logging.INFO)
 # 如果想在控制台打印INFO以上的信息，则加上此配制
 
@@ -93,6 +97,9 @@ class PooledObject:
     def __init__(self, obj):
         self.__obj = obj
         self.__busy = False
+        self.__createdTime = time.monotonic()
+        self.__lastUsedTime = self.__createdTime
+        self.__useCount = 0
 
     def getObject(self):
         return self.__obj
@@ -105,82 +112,675 @@ class PooledObject:
 
     def setBusy(self, busy):
         self.__busy = busy
+        self.__lastUsedTime = time.monotonic()
+        if(busy):
+            self.__useCount += 1
+
+    def getCreatedTime(self):
+        """创建的时间(time.monotonic)"""
+        return self.__createdTime
+
+    def getLastUsedTime(self):
+        """最后一次借用或归还的时间(time.monotonic)"""
+        return self.__lastUsedTime
+
+    def getUseCount(self):
+        """被借用的次数"""
+        return self.__useCount
+
+
+PoolEvent = namedtuple("PoolEvent", ["type", "objectId", "time"])
+"""对象池事件: 事件类型(borrow/return/create/destroy)、对象的id、发生的时间(time.time)"""
+
+
+class PoolObserver(metaclass=ABCMeta):
+    """对象池事件的观察者"""
+
+    @abstractmethod
+    def update(self, pool, events):
+        """对象池批量地通知事件, events为PoolEvent的列表"""
+        pass
+
+
+class LoggingPoolObserver(PoolObserver):
+    """将对象池事件输出到日志"""
+
+    EventNames = {"borrow": "已被借用", "return": "已归还", "create": "已创建", "destroy": "已销毁"}
+
+    def update(self, pool, events):
+        for event in events:
+            logging.info("%x对象%s, time:%s", event.objectId, self.EventNames.get(event.type, event.type),
+                         time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.time)))
+
+
+class GrowthPolicy(metaclass=ABCMeta):
+    """对象池的增长策略: 没有空闲对象时决定一次添加多少个新对象"""
+
+    def recordBorrow(self, isHit):
+        """记录一次借用尝试, isHit表示是否直接借到了空闲对象"""
+        pass
+
+    @abstractmethod
+    def getNumToGrow(self, pool):
+        """需要添加的对象数量, 由子类实现该方法"""
+        pass
+
+
+class FixedGrowthPolicy(GrowthPolicy):
+    """固定大小: 对象池不再增长"""
+
+    def getNumToGrow(self, pool):
+        return 0
+
+
+class StepGrowthPolicy(GrowthPolicy):
+    """按固定步长增长"""
+
+    def __init__(self, step=1):
+        self.__step = step
+
+    def getNumToGrow(self, pool):
+        return self.__step
+
+
+class ExponentialGrowthPolicy(GrowthPolicy):
+    """按倍数增长: 每次增长到当前大小的factor倍"""
+
+    def __init__(self, factor=2):
+        self.__factor = factor
+
+    def getNumToGrow(self, pool):
+        return max(int(pool.getNumOfObjects() * (self.__factor - 1)), 1)
+
+
+class DemandGrowthPolicy(GrowthPolicy):
+    """按需增长: 最近windowSize次借用中未命中的比例越高, 一次增长得越多"""
+
+    def __init__(self, windowSize=100):
+        self.__recentMisses = deque(maxlen=windowSize)
+        self.__numOfMisses = 0
+
+    def recordBorrow(self, isHit):
+        if(len(self.__recentMisses) == self.__recentMisses.maxlen):
+            self.__numOfMisses -= self.__recentMisses[0]
+        isMiss = 0 if isHit else 1
+        self.__recentMisses.append(isMiss)
+        self.__numOfMisses += isMiss
+
+    def getMissRate(self):
+        """最近的未命中率"""
+        return self.__numOfMisses / len(self.__recentMisses) if self.__recentMisses else 0.0
+
+    def getNumToGrow(self, pool):
+        return max(math.ceil(pool.getNumOfObjects() * self.getMissRate()), 1)
 
 
 class ObjectPool(metaclass=ABCMeta):
-    """对象池"""
+    """对象池
+    空闲对象存放在双端队列(空闲链表)中, 并通过以对象id为键的字典找到其包装对象,
+    借用和归还的时间复杂度都是O(1)"""
 
     """对象池初始化大小"""
     InitialNumOfObjects = 10
     """对象池最大的大小"""
     MaxNumOfObjects = 50
+    """清理时最少保留的空闲对象数量"""
+    MinIdleObjects = 0
+    """空闲对象的最长空闲时间(秒), None表示不限制"""
+    MaxIdleTime = None
+    """对象的最长生存时间(秒), None表示不限制"""
+    MaxLifetime = None
+    """累积多少个事件后通知一次观察者"""
+    EventBatchSize = 100
 
-    def __init__(self):
-        self.__pools = []
-        for i in range(0, ObjectPool.InitialNumOfObjects):
-            obj = self.createPooledObject()
-            self.__pools.append(obj)
+    def __init__(self, initialNumOfObjects=None, maxNumOfObjects=None, growthPolicy=None):
+        # 每个对象池可以有自己的大小, 未指定时使用类属性的默认值
+        if(initialNumOfObjects is not None):
+            self.InitialNumOfObjects = initialNumOfObjects
+        if(maxNumOfObjects is not None):
+            self.MaxNumOfObjects = maxNumOfObjects
+        self.__growthPolicy = growthPolicy if growthPolicy is not None else StepGrowthPolicy(1)
+        # 没有观察者时不产生任何事件, 热点路径上只多一次判断
+        self.__observers = []
+        self.__pendingEvents = []
+        self.__numOfBorrows = 0
+        self.__numOfReturns = 0
+        self.__numOfMisses = 0
+        self.__numOfCreations = 0
+        self.__numOfDestructions = 0
+        # 所有的池对象, 以对象的id为键
+        self.__pools = {}
+        # 空闲的池对象
+        self.__freeObjects = deque()
+        for i in range(0, self.InitialNumOfObjects):
+            self._registerObject(self.createPooledObject())
 
     @abstractmethod
     def createPooledObject(self):
         """创建池对象, 由子类实现该方法"""
         pass
 
+    def validateObject(self, pooledObj):
+        """借出前检查对象是否可用(如连接是否已断开), 子类可重写该方法"""
+        return True
+
+    def destroyPooledObject(self, pooledObj):
+        """销毁池对象(如关闭连接、释放文件句柄), 子类可重写该方法"""
+        pass
+
     def borrowObject(self):
         """借用对象"""
         # 如果找到空闲对象，直接返回
         obj = self._findFreeObject()
+        self.__growthPolicy.recordBorrow(obj is not None)
+        if(obj is None):
+            self.__numOfMisses += 1
+            # 如果对象池未满，则按增长策略添加新的对象
+            numToGrow = min(self.__growthPolicy.getNumToGrow(self), self.MaxNumOfObjects - len(self.__pools))
+            self._growPool(numToGrow)
+            obj = self._findFreeObject()
         if(obj is not None):
-            logging.info("%x对象已被借用, time:%s", id(obj),
-                         time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())) )
-            return obj
-        # 如果对象池未满，则添加新的对象
-        if(len(self.__pools) < ObjectPool.MaxNumOfObjects):
-            pooledObj = self.addObject()
-            if (pooledObj is not None):
-                pooledObj.setBusy(True)
-                logging.info("%x对象已被借用, time:%s", id(obj),
-                             time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())))
-                return pooledObj.getObject()
+            self.__numOfBorrows += 1
+            if(self.__observers):
+                self.__addEvent("borrow", obj)
         # 对象池已满且没有空闲对象，则返回None
-        return None
+        return obj
 
     def returnObject(self, obj):
         """归还对象"""
-        for pooledObj in self.__pools:
-            if(pooledObj.getObject() == obj):
-                pooledObj.setBusy(False)
-                logging.info("%x对象已归还, time:%s", id(obj),
-                             time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())))
-                break
+        # 按对象的标识(而不是==)查找包装对象
+        pooledObj = self.__pools.get(id(obj))
+        if(pooledObj is not None and pooledObj.isBusy()):
+            pooledObj.setBusy(False)
+            self.__numOfReturns += 1
+            if(self.__observers):
+                self.__addEvent("return", obj)
+            # 超过生存时间的对象直接销毁
+            if(self._isExpired(pooledObj, time.monotonic())):
+                self._removeObject(pooledObj)
+                return
+            # 归还的对象放在队首, 优先被再次借用, 使较少用的对象保持空闲
+            self.__freeObjects.appendleft(pooledObj)
 
     def addObject(self):
         """添加新对象"""
         obj = None
-        if(len(self.__pools) < ObjectPool.MaxNumOfObjects):
+        if(len(self.__pools) < self.MaxNumOfObjects):
             obj = self.createPooledObject()
-            self.__pools.append(obj)
-            logging.info("添加新对象%x, time:", id(obj),
-                         time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())))
+            self._registerObject(obj)
         return obj
 
+    def _growPool(self, num):
+        """借用时没有空闲对象, 按增长策略添加num个新对象, 子类可重写该方法"""
+        for i in range(0, num):
+            if(self.addObject() is None):
+                break
+
     def clear(self):
         """清空对象池"""
+        self.flushEvents()
         self.__pools.clear()
+        self.__freeObjects.clear()
+
+    def evict(self):
+        """清理对象池: 销毁超过生存时间的空闲对象, 以及空闲太久的对象(至少保留MinIdleObjects个)
+        返回销毁的对象数量"""
+        now = time.monotonic()
+        num = len(self.__freeObjects)
+        freeObjects = deque()
+        # 队尾是最久未用的对象, 从队尾开始清理
+        while self.__freeObjects:
+            pooledObj = self.__freeObjects.pop()
+            isIdleTooLong = self.MaxIdleTime is not None \
+                            and now - pooledObj.getLastUsedTime() > self.MaxIdleTime \
+                            and len(self.__freeObjects) + len(freeObjects) >= self.MinIdleObjects
+            if(isIdleTooLong or self._isExpired(pooledObj, now)):
+                self._removeObject(pooledObj)
+            else:
+                freeObjects.appendleft(pooledObj)
+        self.__freeObjects = freeObjects
+        numOfEvicted = num - len(freeObjects)
+        if(numOfEvicted > 0):
+            logging.info("清理了%d个空闲对象, 剩余%d个对象", numOfEvicted, len(self.__pools))
+        return numOfEvicted
+
+    def addObserver(self, observer):
+        """添加事件的观察者"""
+        self.__observers.append(observer)
+
+    def removeObserver(self, observer):
+        """移除事件的观察者, 移除前先通知尚未发送的事件"""
+        self.flushEvents()
+        self.__observers.remove(observer)
+
+    def flushEvents(self):
+        """将累积的事件通知给所有的观察者"""
+        if(self.__pendingEvents):
+            events = self.__pendingEvents
+            self.__pendingEvents = []
+            for observer in self.__observers:
+                observer.update(self, events)
+
+    def getCounters(self):
+        """获取借用、归还、未命中、创建和销毁的次数"""
+        return {
+            "borrows": self.__numOfBorrows,
+            "returns": self.__numOfReturns,
+            "misses": self.__numOfMisses,
+            "creations": self.__numOfCreations,
+            "destructions": self.__numOfDestructions,
+        }
+
+    def getNumOfObjects(self):
+        """对象池中对象的数量"""
+        return len(self.__pools)
+
+    def getNumOfFreeObjects(self):
+        """对象池中空闲对象的数量"""
+        return len(self.__freeObjects)
+
+    def _registerObject(self, pooledObj):
+        """将池对象登记到对象池中, 并放入空闲链表"""
+        self.__pools[id(pooledObj.getObject())] = pooledObj
+        self.__freeObjects.append(pooledObj)
+        self.__numOfCreations += 1
+        if(self.__observers):
+            self.__addEvent("create", pooledObj.getObject())
+
+    def _removeObject(self, pooledObj):
+        """将池对象从对象池中移除并销毁"""
+        self.__pools.pop(id(pooledObj.getObject()), None)
+        self.destroyPooledObject(pooledObj)
+        self.__numOfDestructions += 1
+        if(self.__observers):
+            self.__addEvent("destroy", pooledObj.getObject())
+
+    def __addEvent(self, eventType, obj):
+        """累积事件, 达到EventBatchSize个时批量通知观察者"""
+        self.__pendingEvents.append(PoolEvent(eventType, id(obj), time.time()))
+        if(len(self.__pendingEvents) >= self.EventBatchSize):
+            self.flushEvents()
+
+    def _isExpired(self, pooledObj, now):
+        """对象是否已超过最长生存时间"""
+        return self.MaxLifetime is not None and now - pooledObj.getCreatedTime() > self.MaxLifetime
 
     def _findFreeObject(self):
-        """查找空闲的对象"""
+        """查找空闲的对象, 过期或检查不通过的对象会被销毁"""
         obj = None
-        for pooledObj in self.__pools:
-            if(not pooledObj.isBusy()):
-                obj = pooledObj.getObject()
-                pooledObj.setBusy(True)
-                break
+        while self.__freeObjects:
+            pooledObj = self.__freeObjects.popleft()
+            if(self._isExpired(pooledObj, time.monotonic()) or not self.validateObject(pooledObj)):
+                self._removeObject(pooledObj)
+                continue
+            pooledObj.setBusy(True)
+            obj = pooledObj.getObject()
+            break
         return obj
 
 
+# 线程安全的对象池
+#==============================
+import threading
+# 引入线程模块
+from concurrent.futures import ThreadPoolExecutor, wait as futuresWait
+# 引入线程池, 用于并行地创建对象
+import weakref
+# 引入弱引用模块, 租约被垃圾回收时自动归还对象
+import traceback
+# 引入调用栈模块, 调试模式下记录借用者的调用栈
+
+LeaseInfo = namedtuple("LeaseInfo", ["object", "borrowedTime", "threadName", "stack"])
+"""借出记录: 借出的对象、借出的时间(time.monotonic)、借用者的线程名、借用者的调用栈(仅调试模式)"""
+
+
+class Lease:
+    """对象的租约
+    通过租约使用借来的对象; 释放后不能再使用该对象, 忘记释放时租约被垃圾回收后自动归还"""
+
+    def __init__(self, pool, obj):
+        self.__obj = obj
+        self.__pool = pool
+        # 回调中不能引用租约本身, 否则租约永远不会被回收
+        self.__finalizer = weakref.finalize(self, pool._abandonObject, obj)
+
+    def getObject(self):
+        if(self.__obj is None):
+            raise RuntimeError("租约已释放, 不能再使用该对象！")
+        return self.__obj
+
+    def isReleased(self):
+        return self.__obj is None
+
+    def release(self):
+        """释放租约, 归还对象"""
+        if(self.__obj is not None):
+            self.__finalizer.detach()
+            obj = self.__obj
+            self.__obj = None
+            self.__pool.returnObject(obj)
+
+    def __enter__(self):
+        return self.getObject()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class BlockingObjectPool(ObjectPool):
+    """线程安全的阻塞式对象池
+    对象池已满时借用者排队等待(可设置超时时间), 等待者按先来先得(FIFO)的顺序获得对象"""
+
+    """调试模式: 借出对象时记录借用者的调用栈, 用于查找泄漏的对象"""
+    DebugLeases = False
+    """使用租约后, 等待者最多每隔多少秒检查一次被回收的租约"""
+    AbandonedCheckInterval = 0.1
+
+    def __init__(self, initialNumOfObjects=None, maxNumOfObjects=None, growthPolicy=None):
+        # 所有的等待者共用一把锁, 每个等待者有自己的条件变量, 归还对象时只唤醒队首的等待者
+        self.__lock = threading.RLock()
+        self.__waiters = deque()
+        self.__borrowCount = 0
+        self.__timeoutCount = 0
+        self.__totalWaitTime = 0.0
+        self.__maxWaitTime = 0.0
+        self.__maxQueueDepth = 0
+        self.__evictor = None
+        self.__evictorStopped = None
+        # 正在创建的对象数量, 计入对象池的大小
+        self.__numOfCreating = 0
+        # 队首的借用者已预留、需要在锁外创建的对象数量
+        self.__numToCreate = 0
+        self.__warmUpFutures = []
+        # 所有借出的对象, 以对象的id为键
+        self.__leases = {}
+        # 租约被垃圾回收后等待归还的对象
+        self.__abandonedObjects = deque()
+        self.__usesLeases = False
+        self.__watchdog = None
+        self.__watchdogStopped = None
+        with self.__lock:
+            super().__init__(initialNumOfObjects, maxNumOfObjects, growthPolicy)
+
+    def borrowObject(self, timeout=None):
+        """借用对象
+        timeout为None时一直等待, 为0时不等待; 超时仍未借到则返回None"""
+        startTime = time.monotonic()
+        with self.__lock:
+            waiter = threading.Condition(self.__lock)
+            self.__waiters.append(waiter)
+            self.__maxQueueDepth = max(self.__maxQueueDepth, len(self.__waiters))
+            try:
+                while True:
+                    obj = self.__waitForObject(waiter, startTime, timeout)
+                    numToCreate = self.__numToCreate
+                    if(obj is not None or numToCreate == 0):
+                        break
+                    # 创建对象可能很慢, 创建期间释放锁, 其他线程可以归还对象
+                    self.__numToCreate = 0
+                    self.__lock.release()
+                    try:
+                        self.__createReserved(numToCreate)
+                    finally:
+                        self.__lock.acquire()
+            finally:
+                if(self.__waiters[0] is waiter):
+                    self.__waiters.popleft()
+                else:
+                    self.__waiters.remove(waiter)
+                # 轮到下一个等待者
+                if(self.__waiters):
+                    self.__waiters[0].notify()
+            waitTime = time.monotonic() - startTime
+            self.__totalWaitTime += waitTime
+            self.__maxWaitTime = max(self.__maxWaitTime, waitTime)
+            if(obj is not None):
+                self.__borrowCount += 1
+                stack = traceback.extract_stack()[:-1] if self.DebugLeases else None
+                self.__leases[id(obj)] = LeaseInfo(obj, time.monotonic(), threading.current_thread().name, stack)
+            else:
+                self.__timeoutCount += 1
+        return obj
+
+    def __waitForObject(self, waiter, startTime, timeout):
+        """排到队首且有可借用的对象时返回该对象, 超时或需要创建新对象时返回None"""
+        while True:
+            if(self.__waiters[0] is waiter):
+                self.__returnAbandonedObjects()
+                obj = super().borrowObject()
+                if(obj is not None or self.__numToCreate > 0):
+                    return obj
+            remaining = None
+            if(timeout is not None):
+                remaining = startTime + timeout - time.monotonic()
+                if(remaining <= 0):
+                    return None
+            # 租约被回收时可能拿不到锁来唤醒等待者, 等待者要定期自己检查
+            if(self.__usesLeases and (remaining is None or remaining > self.AbandonedCheckInterval)):
+                remaining = self.AbandonedCheckInterval
+            waiter.wait(remaining)
+
+    def returnObject(self, obj):
+        """归还对象, 并唤醒队首的等待者"""
+        with self.__lock:
+            self.__leases.pop(id(obj), None)
+            super().returnObject(obj)
+            if(self.__waiters):
+                self.__waiters[0].notify()
+
+    def leaseObject(self, timeout=None):
+        """借用对象并返回它的租约(Lease), 超时返回None"""
+        self.__usesLeases = True
+        obj = self.borrowObject(timeout)
+        return Lease(self, obj) if obj is not None else None
+
+    def checkLeases(self, threshold):
+        """返回借出时间超过threshold秒的借出记录"""
+        with self.__lock:
+            self.__returnAbandonedObjects()
+            now = time.monotonic()
+            return [info for info in self.__leases.values() if now - info.borrowedTime > threshold]
+
+    def startLeaseWatchdog(self, threshold, interval=None):
+        """启动监控线程, 定期报告借出时间超过threshold秒的对象, 并归还被回收的租约对应的对象"""
+        self.stopLeaseWatchdog()
+        self.__watchdogStopped = threading.Event()
+        self.__watchdog = threading.Thread(target=self.__runWatchdog,
+                                           args=(threshold, interval or threshold, self.__watchdogStopped),
+                                           name="ObjectPoolWatchdog", daemon=True)
+        self.__watchdog.start()
+
+    def stopLeaseWatchdog(self):
+        """停止监控线程"""
+        if(self.__watchdog is not None):
+            self.__watchdogStopped.set()
+            self.__watchdog.join()
+            self.__watchdog = None
+
+    def __runWatchdog(self, threshold, interval, stopped):
+        while not stopped.wait(interval):
+            now = time.monotonic()
+            for info in self.checkLeases(threshold):
+                message = "%x对象已被%s借出%.1f秒, 可能已泄漏" % (id(info.object), info.threadName, now - info.borrowedTime)
+                if(info.stack is not None):
+                    message += ", 借用位置:\n" + "".join(traceback.format_list(info.stack))
+                logging.warning(message)
+
+    def _abandonObject(self, obj):
+        """租约被垃圾回收时调用
+        回收可能发生在任意代码之间, 这里只记录下来, 由队首的等待者或下一次借用、检查时再归还;
+        能立即拿到锁时唤醒队首的等待者, 拿不到锁时(其他线程正持有)不能阻塞, 由等待者定期检查"""
+        self.__abandonedObjects.append(obj)
+        if(self.__lock.acquire(blocking=False)):
+            try:
+                if(self.__waiters):
+                    self.__waiters[0].notify()
+            finally:
+                self.__lock.release()
+
+    def __returnAbandonedObjects(self):
+        while self.__abandonedObjects:
+            obj = self.__abandonedObjects.popleft()
+            logging.warning("%x对象的租约未释放就被回收了, 已自动归还", id(obj))
+            self.returnObject(obj)
+
+    def addObject(self):
+        """添加新对象: 在锁内预留容量, 在锁外创建"""
+        with self.__lock:
+            if(self.getNumOfObjects() + self.__numOfCreating >= self.MaxNumOfObjects):
+                return None
+            self.__numOfCreating += 1
+        return self.__createReserved(1)[0]
+
+    def _growPool(self, num):
+        """只预留容量, 由队首的借用者释放锁后再创建; 正在创建(如预热)的对象也算在增长的数量里"""
+        num = min(num - self.__numOfCreating,
+                  self.MaxNumOfObjects - self.getNumOfObjects() - self.__numOfCreating)
+        if(num > 0):
+            self.__numOfCreating += num
+            self.__numToCreate += num
+
+    def __createReserved(self, num):
+        """在锁外创建已预留容量的num个对象, 创建完成后登记到对象池中并唤醒队首的等待者"""
+        pooledObjs = []
+        try:
+            for i in range(0, num):
+                pooledObjs.append(self.createPooledObject())
+        finally:
+            with self.__lock:
+                self.__numOfCreating -= num
+                for pooledObj in pooledObjs:
+                    self._registerObject(pooledObj)
+                if(self.__waiters):
+                    self.__waiters[0].notify()
+        return pooledObjs
+
+    def warmUp(self, targetSize=None, maxWorkers=4, wait=True):
+        """预热对象池: 用线程池并行地创建对象, 直到对象池达到targetSize(默认为InitialNumOfObjects)
+        wait为False时在后台创建, 对象池在预热期间就可以正常借用"""
+        with self.__lock:
+            if(targetSize is None):
+                targetSize = self.InitialNumOfObjects
+            targetSize = min(targetSize, self.MaxNumOfObjects)
+            num = max(targetSize - self.getNumOfObjects() - self.__numOfCreating, 0)
+            self.__numOfCreating += num
+        executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="ObjectPoolWarmUp")
+        futures = [executor.submit(self.__createInBackground) for i in range(0, num)]
+        # 任务执行完后线程自动退出
+        executor.shutdown(wait=False)
+        with self.__lock:
+            self.__warmUpFutures = [future for future in self.__warmUpFutures if not future.done()] + futures
+        if(wait):
+            self.waitUntilReady()
+
+    def isReady(self):
+        """预热是否已完成"""
+        return self.getWarmUpProgress()["pending"] == 0
+
+    def waitUntilReady(self, timeout=None):
+        """等待预热完成, 返回是否已完成"""
+        with self.__lock:
+            futures = list(self.__warmUpFutures)
+        futuresWait(futures, timeout)
+        return self.isReady()
+
+    def getWarmUpProgress(self):
+        """预热的进度: 已创建、创建失败和等待创建的对象数量"""
+        with self.__lock:
+            futures = list(self.__warmUpFutures)
+        progress = {"created": 0, "failed": 0, "pending": 0}
+        for future in futures:
+            if(not future.done()):
+                progress["pending"] += 1
+            elif(future.exception() is not None):
+                progress["failed"] += 1
+            else:
+                progress["created"] += 1
+        return progress
+
+    def __createInBackground(self):
+        """在后台线程中创建对象(不持有锁), 创建完成后登记到对象池中"""
+        try:
+            pooledObj = self.createPooledObject()
+        except Exception:
+            logging.exception("预热时创建对象失败")
+            with self.__lock:
+                self.__numOfCreating -= 1
+            raise
+        with self.__lock:
+            self.__numOfCreating -= 1
+            self._registerObject(pooledObj)
+            if(self.__waiters):
+                self.__waiters[0].notify()
+
+    def clear(self):
+        with self.__lock:
+            super().clear()
+
+    def addObserver(self, observer):
+        with self.__lock:
+            super().addObserver(observer)
+
+    def removeObserver(self, observer):
+        with self.__lock:
+            super().removeObserver(observer)
+
+    def flushEvents(self):
+        with self.__lock:
+            super().flushEvents()
+
+    def getCounters(self):
+        with self.__lock:
+            return super().getCounters()
+
+    def evict(self):
+        with self.__lock:
+            numOfEvicted = super().evict()
+            # 清理后有了空余的容量, 唤醒队首的等待者
+            if(numOfEvicted > 0 and self.__waiters):
+                self.__waiters[0].notify()
+            return numOfEvicted
+
+    def startEvictor(self, interval):
+        """启动后台清理线程, 每隔interval秒清理一次对象池"""
+        self.stopEvictor()
+        self.__evictorStopped = threading.Event()
+        self.__evictor = threading.Thread(target=self.__runEvictor, args=(interval, self.__evictorStopped),
+                                          name="ObjectPoolEvictor", daemon=True)
+        self.__evictor.start()
+
+    def stopEvictor(self):
+        """停止后台清理线程"""
+        if(self.__evictor is not None):
+            self.__evictorStopped.set()
+            self.__evictor.join()
+            self.__evictor = None
+
+    def __runEvictor(self, interval, stopped):
+        while not stopped.wait(interval):
+            self.evict()
+
+    def getMetrics(self):
+        """获取对象池的运行指标, 用于评估对象池的大小是否合适"""
+        with self.__lock:
+            numOfWaits = self.__borrowCount + self.__timeoutCount
+            return {
+                "borrowCount": self.__borrowCount,
+                "timeoutCount": self.__timeoutCount,
+                "avgWaitTime": self.__totalWaitTime / numOfWaits if numOfWaits > 0 else 0.0,
+                "maxWaitTime": self.__maxWaitTime,
+                "queueDepth": len(self.__waiters),
+                "maxQueueDepth": self.__maxQueueDepth,
+            }
+
+
 # 基于框架的实现
 #==============================
+import itertools
+# 引入迭代器工具模块, 用于生成序列号
+import random
+# 引入随机数模块
+
 class PowerBank:
     """移动电源"""
 
@@ -207,18 +807,23 @@ class PowerBank:
 class PowerBankPool(ObjectPool):
     """存放移动电源的智能箱盒"""
 
-    __serialNum = 0
+    # 序列号生成器, 多个线程同时创建对象时也不会重复
+    __serialNum = itertools.count(1)
 
     @classmethod
     def getSerialNum(cls):
-        cls.__serialNum += 1
-        return cls.__serialNum
+        return next(cls.__serialNum)
 
 
     def createPooledObject(self):
         powerBank = PowerBank(PowerBankPool.getSerialNum(), 100)
         return PooledObject(powerBank)
 
+class BlockingPowerBankPool(BlockingObjectPool, PowerBankPool):
+    """可供多人同时借用的智能箱盒"""
+    pass
+
+
 # Test
 #=======================================================================================================================
 def testPowerBank():
@@ -241,6 +846,7 @@ def testPowerBank():
 
 def testObjectPool():
     powerBankPool = PowerBankPool()
+    powerBankPool.addObserver(LoggingPoolObserver())
     powerBank1 = powerBankPool.borrowObject()
     if (powerBank1 is not None):
         powerBank1.setUser("Tony")
@@ -258,8 +864,188 @@ def testObjectPool():
 
     powerBankPool.returnObject(powerBank2)
     powerBankPool.returnObject(powerBank3)
+    print(powerBankPool.getCounters())
     powerBankPool.clear()
 
+
+def testObjectPoolPerformance():
+    """借用和归还的耗时不随对象池大小变化"""
+    for size in (10, 100, 1000, 10000, 100000):
+        pool = PowerBankPool(size, size)
+        # 只留一个空闲对象, 这是线性查找的最坏情况
+        for i in range(0, size - 1):
+            pool.borrowObject()
+        times = 10000
+        start = time.perf_counter()
+        for i in range(0, times):
+            pool.returnObject(pool.borrowObject())
+        cost = time.perf_counter() - start
+        print("对象池大小:%6d  每次借用+归还耗时:%.3fus" % (size, cost / times * 1000000))
+
+def testBlockingObjectPool():
+    powerBankPool = BlockingPowerBankPool(2, 2)
+
+    def usePowerBank(user):
+        powerBank = powerBankPool.borrowObject(timeout=1)
+        if (powerBank is None):
+            print("%s 等待超时，没有借到移动电源！" % user)
+            return
+        powerBank.setUser(user)
+        powerBank.showInfo()
+        time.sleep(0.1)
+        powerBankPool.returnObject(powerBank)
+
+    users = [threading.Thread(target=usePowerBank, args=(user,)) for user in ["Tony", "Sam", "Aimee", "Jacky", "Kerry"]]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    print(powerBankPool.getMetrics())
+
+def testObjectPoolEviction():
+    class ShortLivedPowerBankPool(BlockingPowerBankPool):
+        InitialNumOfObjects = 5
+        MinIdleObjects = 2
+        MaxIdleTime = 0.1
+        MaxLifetime = 1
+
+        def validateObject(self, pooledObj):
+            # 没电的移动电源不能借出
+            return pooledObj.getObject().getElectricQuantity() > 0
+
+    powerBankPool = ShortLivedPowerBankPool()
+    powerBankPool.startEvictor(0.05)
+    powerBanks = [powerBankPool.borrowObject() for i in range(0, 10)]
+    for powerBank in powerBanks:
+        powerBankPool.returnObject(powerBank)
+    print("高峰时的对象数量:%d" % powerBankPool.getNumOfObjects())
+    time.sleep(0.3)
+    print("空闲一段时间后的对象数量:%d" % powerBankPool.getNumOfObjects())
+    time.sleep(1)
+    print("超过生存时间后的对象数量:%d" % powerBankPool.getNumOfObjects())
+    powerBankPool.stopEvictor()
+
+def testObjectPoolWarmUp():
+    class SlowPowerBankPool(BlockingPowerBankPool):
+        # 初始时不创建对象, 由warmUp并行地创建
+        InitialNumOfObjects = 0
+
+        def createPooledObject(self):
+            # 模拟耗时的创建过程
+            time.sleep(0.1)
+            return super().createPooledObject()
+
+    powerBankPool = SlowPowerBankPool()
+    start = time.perf_counter()
+    powerBankPool.warmUp(20, maxWorkers=10)
+    print("并行预热20个对象耗时:%.2fs, 对象数量:%d" % (time.perf_counter() - start, powerBankPool.getNumOfObjects()))
+
+    powerBankPool = SlowPowerBankPool()
+    powerBankPool.warmUp(20, maxWorkers=2, wait=False)
+    powerBank = powerBankPool.borrowObject()
+    print("后台预热期间借到了%03d号移动电源, 预热进度:%s" % (powerBank.getSerialNum(), powerBankPool.getWarmUpProgress()))
+    powerBankPool.returnObject(powerBank)
+    powerBankPool.waitUntilReady()
+    print("预热完成:%s, 对象数量:%d" % (powerBankPool.isReady(), powerBankPool.getNumOfObjects()))
+
+def testGrowthPolicy():
+    """用同一个模拟的借用序列比较不同增长策略的命中率和内存(对象数量)"""
+    random.seed(0)
+    # 模拟的负载: 每一步同时在用的对象数量, 平时较低, 偶尔出现高峰
+    demands = []
+    for step in range(0, 2000):
+        demand = random.randint(5, 15)
+        if(step % 200 >= 150):
+            demand += random.randint(40, 80)
+        demands.append(demand)
+
+    policies = {
+        "Fixed": FixedGrowthPolicy(),
+        "Step(1)": StepGrowthPolicy(1),
+        "Step(10)": StepGrowthPolicy(10),
+        "Exponential(2)": ExponentialGrowthPolicy(2),
+        "Demand": DemandGrowthPolicy(100),
+    }
+    for name, policy in policies.items():
+        pool = PowerBankPool(10, 100, policy)
+        borrowed = []
+        numOfBorrows = numOfHits = numOfFailures = totalSize = 0
+        for demand in demands:
+            while len(borrowed) > demand:
+                pool.returnObject(borrowed.pop())
+            while len(borrowed) < demand:
+                numOfFree = pool.getNumOfFreeObjects()
+                obj = pool.borrowObject()
+                numOfBorrows += 1
+                if(obj is None):
+                    numOfFailures += 1
+                    break
+                if(numOfFree > 0):
+                    numOfHits += 1
+                borrowed.append(obj)
+            totalSize += pool.getNumOfObjects()
+        print("%-16s 命中率:%.2f%%  失败率:%.2f%%  平均对象数:%.1f  最终对象数:%d"
+              % (name, numOfHits / numOfBorrows * 100, numOfFailures / numOfBorrows * 100,
+                 totalSize / len(demands), pool.getNumOfObjects()))
+
+def testPoolObserverOverhead():
+    """比较没有观察者和有观察者时借用+归还的耗时"""
+    class CountingObserver(PoolObserver):
+        def __init__(self):
+            self.numOfEvents = 0
+
+        def update(self, pool, events):
+            self.numOfEvents += len(events)
+
+    times = 100000
+    pool = PowerBankPool(10, 10)
+    start = time.perf_counter()
+    for i in range(0, times):
+        pool.returnObject(pool.borrowObject())
+    costWithoutObserver = time.perf_counter() - start
+
+    observer = CountingObserver()
+    pool.addObserver(observer)
+    start = time.perf_counter()
+    for i in range(0, times):
+        pool.returnObject(pool.borrowObject())
+    pool.flushEvents()
+    costWithObserver = time.perf_counter() - start
+    print("没有观察者: %.3fus/次  有观察者: %.3fus/次  收到事件:%d个"
+          % (costWithoutObserver / times * 1000000, costWithObserver / times * 1000000, observer.numOfEvents))
+
+def testLeaseTracking():
+    class DebugPowerBankPool(BlockingPowerBankPool):
+        DebugLeases = True
+
+    powerBankPool = DebugPowerBankPool(2, 2)
+    powerBankPool.startLeaseWatchdog(0.2, 0.1)
+    # 借用后忘记归还, 监控线程会报告借用的位置
+    powerBank = powerBankPool.borrowObject()
+    time.sleep(0.3)
+    powerBankPool.returnObject(powerBank)
+
+    with powerBankPool.leaseObject() as powerBank:
+        powerBank.setUser("Tony")
+        powerBank.showInfo()
+    # 租约被回收后, 对象自动归还
+    lease = powerBankPool.leaseObject()
+    lease.getObject().setUser("Sam")
+    lease = None
+    lease1 = powerBankPool.leaseObject(timeout=1)
+    lease2 = powerBankPool.leaseObject(timeout=1)
+    print("租约被回收后能否借到两个对象:", lease1 is not None and lease2 is not None)
+    lease1.release()
+    lease2.release()
+    powerBankPool.stopLeaseWatchdog()
+
 # testPowerBank()
 testObjectPool()
+# testObjectPoolPerformance()
+# testBlockingObjectPool()
+# testObjectPoolEviction()
+# testObjectPoolWarmUp()
+# testGrowthPolicy()
+# testPoolObserverOverhead()
+# testLeaseTracking()
 
@@ -0,0 +1,203 @@
+"""
+模式: 对象池模式
+功能: 基于asyncio的对象池, 大量协程共享有限个昂贵的对象, 不需要切换线程
+"""
+from abc import ABCMeta, abstractmethod
+# 引入ABCMeta和abstractmethod来定义抽象类和抽象方法
+import asyncio
+# 引入异步IO模块
+from contextlib import asynccontextmanager
+# 引入异步上下文管理器的装饰器
+from collections import deque
+# 引入双端队列, 用于存放空闲的池对象和等待者
+from advanced_pattern.ObjectPool import PooledObject, PowerBank, PowerBankPool
+# 引入池对象和移动电源
+
+
+class AsyncObjectPool(metaclass=ABCMeta):
+    """异步对象池
+    对象池已满时借用者按先来先得(FIFO)的顺序等待; 归还的对象直接交给队首的等待者"""
+
+    """对象池初始化大小"""
+    InitialNumOfObjects = 10
+    """对象池最大的大小"""
+    MaxNumOfObjects = 50
+
+    def __init__(self):
+        # 所有的池对象, 以对象的id为键
+        self.__pools = {}
+        # 空闲的池对象
+        self.__freeObjects = deque()
+        # 等待者(Future)队列
+        self.__waiters = deque()
+        # 已创建和正在创建的对象数量
+        self.__size = 0
+
+    @abstractmethod
+    async def createPooledObject(self):
+        """创建池对象, 由子类实现该方法"""
+        pass
+
+    async def initialize(self):
+        """并发地创建初始的对象"""
+        num = min(self.InitialNumOfObjects, self.MaxNumOfObjects) - self.__size
+        pooledObjs = await asyncio.gather(*[self.__createObject() for i in range(0, num)])
+        for pooledObj in pooledObjs:
+            self.__handOver(pooledObj)
+
+    async def acquire(self, timeout=None):
+        """借用对象
+        timeout为None时一直等待; 超时仍未借到则返回None"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        # 已有排队者时新来者也要排队, 保证先来先得
+        mustWait = len(self.__waiters) > 0
+        isRetry = False
+        while True:
+            if(not mustWait):
+                if(self.__freeObjects):
+                    return self.__lend(self.__freeObjects.popleft())
+                if(self.__size < self.MaxNumOfObjects):
+                    return self.__lend(await self.__createObject())
+
+            waiter = loop.create_future()
+            # 被唤醒后仍没借到的等待者重新排在队首
+            if(isRetry):
+                self.__waiters.appendleft(waiter)
+            else:
+                self.__waiters.append(waiter)
+            try:
+                remaining = None if deadline is None else max(deadline - loop.time(), 0)
+                pooledObj = await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                self.__abandon(waiter)
+                return None
+            except asyncio.CancelledError:
+                self.__abandon(waiter)
+                raise
+            if(pooledObj is not None):
+                return self.__lend(pooledObj)
+            # 收到None表示有容量空出来, 可以创建新对象
+            mustWait = False
+            isRetry = True
+
+    def release(self, obj):
+        """归还对象
+        这是一个普通方法, 在finally中或任务被取消时也能安全地调用"""
+        pooledObj = self.__pools.get(id(obj))
+        if(pooledObj is not None and pooledObj.isBusy()):
+            pooledObj.setBusy(False)
+            self.__handOver(pooledObj)
+
+    @asynccontextmanager
+    async def lease(self, timeout=None):
+        """以异步上下文管理器的方式借用对象, 退出时自动归还"""
+        obj = await self.acquire(timeout)
+        if(obj is None):
+            raise asyncio.TimeoutError("借用对象超时")
+        try:
+            yield obj
+        finally:
+            self.release(obj)
+
+    def clear(self):
+        """清空对象池"""
+        self.__pools.clear()
+        self.__freeObjects.clear()
+        self.__size = 0
+
+    def getNumOfObjects(self):
+        """对象池中对象的数量"""
+        return len(self.__pools)
+
+    def getNumOfFreeObjects(self):
+        """对象池中空闲对象的数量"""
+        return len(self.__freeObjects)
+
+    def getNumOfWaiters(self):
+        """正在等待的借用者数量"""
+        return len(self.__waiters)
+
+    async def __createObject(self):
+        """创建对象并登记到对象池中, 创建失败或被取消时让出占用的容量"""
+        self.__size += 1
+        try:
+            pooledObj = await self.createPooledObject()
+        except BaseException:
+            self.__size -= 1
+            self.__handOver(None)
+            raise
+        self.__pools[id(pooledObj.getObject())] = pooledObj
+        return pooledObj
+
+    def __lend(self, pooledObj):
+        pooledObj.setBusy(True)
+        return pooledObj.getObject()
+
+    def __handOver(self, pooledObj):
+        """将空闲对象(或空出来的容量, 此时为None)交给队首的等待者, 没有等待者时放回空闲链表"""
+        while self.__waiters:
+            waiter = self.__waiters.popleft()
+            if(not waiter.done()):
+                waiter.set_result(pooledObj)
+                return
+        if(pooledObj is not None):
+            self.__freeObjects.appendleft(pooledObj)
+
+    def __abandon(self, waiter):
+        """等待者放弃等待; 如果对象已经交给了它, 则转交给下一个等待者"""
+        if(waiter.done() and not waiter.cancelled()):
+            self.__handOver(waiter.result())
+        else:
+            waiter.cancel()
+            try:
+                self.__waiters.remove(waiter)
+            except ValueError:
+                pass
+
+
+# 基于框架的实现
+#==============================
+class AsyncPowerBankPool(AsyncObjectPool):
+    """存放移动电源的智能箱盒(异步版)"""
+
+    InitialNumOfObjects = 2
+    MaxNumOfObjects = 5
+
+    async def createPooledObject(self):
+        # 模拟耗时的创建过程
+        await asyncio.sleep(0.01)
+        return PooledObject(PowerBank(PowerBankPool.getSerialNum(), 100))
+
+
+# Test
+#=======================================================================================================================
+def testAsyncObjectPool():
+    async def usePowerBank(powerBankPool, user):
+        async with powerBankPool.lease() as powerBank:
+            powerBank.setUser(user)
+            await asyncio.sleep(0.01)
+        return powerBank.getSerialNum()
+
+    async def main():
+        powerBankPool = AsyncPowerBankPool()
+        await powerBankPool.initialize()
+        serialNums = await asyncio.gather(*[usePowerBank(powerBankPool, "User%d" % i) for i in range(0, 1000)])
+        print("1000个协程共使用了%d个移动电源" % len(set(serialNums)))
+
+        # 取消正在等待的借用者, 不会影响其他借用者
+        powerBank = await powerBankPool.acquire()
+        others = [await powerBankPool.acquire() for i in range(0, powerBankPool.getNumOfObjects() - 1)]
+        task = asyncio.ensure_future(powerBankPool.acquire())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        powerBankPool.release(powerBank)
+        print("等待者数量:%d  空闲对象数量:%d" % (powerBankPool.getNumOfWaiters(), powerBankPool.getNumOfFreeObjects()))
+        print("取消等待后能否借到对象:", await powerBankPool.acquire(timeout=0.01) is not None)
+        for obj in others:
+            powerBankPool.release(obj)
+
+    asyncio.run(main())
+
+
+testAsyncObjectPool()
@@ -0,0 +1,247 @@
+"""
+模式: 对象池模式
+功能: 多进程共享的对象池, 同一台机器上的多个工作进程共用一份有限的槽位(如后端连接数)
+说明: 槽位的占用标志存放在共享内存的位图中; 每个进程在自己占用的槽位上创建并缓存本地对象
+运行: 在Test.py中导入本模块(import advanced_pattern.ObjectPool_shared), 或者直接运行本文件
+     (python advanced_pattern/ObjectPool_shared.py), 都会在主进程中运行testSharedObjectPool
+"""
+from abc import ABCMeta, abstractmethod
+# 引入ABCMeta和abstractmethod来定义抽象类和抽象方法
+import multiprocessing
+# 引入多进程模块
+from multiprocessing import shared_memory
+# 引入共享内存模块
+import os
+# 引入操作系统模块, 用于获取进程id
+import sys
+# 引入系统模块, 直接运行本文件时设置模块的搜索路径
+import struct
+# 引入结构体模块, 用于在共享内存中读写进程id
+import time
+# 引入时间模块
+import weakref
+# 引入弱引用模块, 记录所有的共享对象池, fork之后在子进程中重置它们
+if(not __package__):
+    # 直接运行本文件时, 把项目的根目录加入搜索路径, 才能导入advanced_pattern包
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from advanced_pattern.ObjectPool import PooledObject, PowerBank, PowerBankPool
+# 引入池对象和移动电源
+
+
+class SharedObjectPool(metaclass=ABCMeta):
+    """多进程共享的对象池
+    共享内存的布局: [槽位位图, 每个槽位1位][每个槽位占用者的进程id, 每个4字节]
+    CPython没有提供共享内存上的原子操作, 占用和释放槽位由一把跨进程的锁保护, 临界区只有几次内存读写"""
+
+    """等待空闲槽位时的轮询间隔(秒)"""
+    PollInterval = 0.001
+
+    # 本进程中所有的共享对象池
+    __instances = weakref.WeakSet()
+
+    def __init__(self, numOfSlots, lock=None, name=None):
+        """name为None时创建新的共享内存, 否则连接到已有的共享内存"""
+        self.__numOfSlots = numOfSlots
+        self.__bitmapSize = (numOfSlots + 7) // 8
+        # 创建共享内存的进程, 只有它在close时删除共享内存; fork出的子进程继承了这个对象, 但不是创建者
+        self.__ownerPid = os.getpid() if name is None else None
+        self.__lock = lock if lock is not None else multiprocessing.Lock()
+        if(name is None):
+            self.__shm = shared_memory.SharedMemory(create=True, size=self.__bitmapSize + 4 * numOfSlots)
+            self.__shm.buf[:] = bytes(self.__shm.size)
+        else:
+            self.__shm = shared_memory.SharedMemory(name=name)
+        # 本进程在各个槽位上创建的对象, 以槽位为键
+        self.__localObjects = {}
+        # 本进程借出的对象, 以对象的id为键, 值为槽位
+        self.__borrowedSlots = {}
+        SharedObjectPool.__instances.add(self)
+
+    def __getstate__(self):
+        """传给子进程时只传递共享内存的名称和锁, 本地对象不跨进程"""
+        return {"numOfSlots": self.__numOfSlots, "lock": self.__lock, "name": self.__shm.name}
+
+    def __setstate__(self, state):
+        SharedObjectPool.__init__(self, state["numOfSlots"], state["lock"], state["name"])
+
+    @abstractmethod
+    def createPooledObject(self):
+        """创建池对象, 由子类实现该方法"""
+        pass
+
+    def borrowObject(self, timeout=None):
+        """借用对象
+        timeout为None时一直等待, 为0时不等待; 超时仍未借到则返回None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        slot = self.__claimSlot()
+        while slot is None:
+            if(deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(self.PollInterval)
+            slot = self.__claimSlot()
+        pooledObj = self.__localObjects.get(slot)
+        if(pooledObj is None):
+            pooledObj = self.createPooledObject()
+            self.__localObjects[slot] = pooledObj
+        pooledObj.setBusy(True)
+        obj = pooledObj.getObject()
+        self.__borrowedSlots[id(obj)] = slot
+        return obj
+
+    def returnObject(self, obj):
+        """归还对象, 释放其占用的槽位"""
+        slot = self.__borrowedSlots.pop(id(obj), None)
+        if(slot is not None):
+            self.__localObjects[slot].setBusy(False)
+            self.__releaseSlot(slot)
+
+    def getNumOfBusySlots(self):
+        """所有进程占用的槽位数量"""
+        with self.__lock:
+            return sum(bin(byte).count("1") for byte in self.__shm.buf[:self.__bitmapSize])
+
+    def reclaimDeadSlots(self):
+        """释放已退出的进程占用的槽位, 返回释放的数量"""
+        num = 0
+        with self.__lock:
+            for slot in range(0, self.__numOfSlots):
+                if(self.__isBusy(slot) and not self.__isAlive(self.__getOwner(slot))):
+                    self.__setBusy(slot, False)
+                    num += 1
+        return num
+
+    def close(self):
+        """断开共享内存; 创建者还会删除共享内存"""
+        self.__localObjects.clear()
+        self.__borrowedSlots.clear()
+        self.__shm.close()
+        if(self.__ownerPid == os.getpid()):
+            self.__shm.unlink()
+
+    @classmethod
+    def _afterForkInChild(cls):
+        """fork之后在子进程中调用: 子进程不是共享内存的创建者, 父进程的本地对象和借出的对象也不属于子进程
+        (它们占用的槽位仍由父进程使用和归还)"""
+        for pool in list(cls.__instances):
+            pool.__ownerPid = None
+            pool.__localObjects = {}
+            pool.__borrowedSlots = {}
+
+    def __claimSlot(self):
+        """占用一个空闲的槽位, 没有空闲槽位时返回None"""
+        pid = os.getpid()
+        with self.__lock:
+            buf = self.__shm.buf
+            # 优先使用本进程已创建过对象的槽位
+            for slot in self.__localObjects:
+                if(not self.__isBusy(slot)):
+                    self.__setBusy(slot, True, pid)
+                    return slot
+            for index in range(0, self.__bitmapSize):
+                if(buf[index] != 0xFF):
+                    for bit in range(0, 8):
+                        slot = index * 8 + bit
+                        if(slot < self.__numOfSlots and not buf[index] & (1 << bit)):
+                            self.__setBusy(slot, True, pid)
+                            return slot
+        return None
+
+    def __releaseSlot(self, slot):
+        with self.__lock:
+            self.__setBusy(slot, False)
+
+    def __isBusy(self, slot):
+        return bool(self.__shm.buf[slot // 8] & (1 << (slot % 8)))
+
+    def __setBusy(self, slot, busy, pid=0):
+        if(busy):
+            self.__shm.buf[slot // 8] |= 1 << (slot % 8)
+        else:
+            self.__shm.buf[slot // 8] &= ~(1 << (slot % 8)) & 0xFF
+        struct.pack_into("i", self.__shm.buf, self.__bitmapSize + 4 * slot, pid)
+
+    def __getOwner(self, slot):
+        return struct.unpack_from("i", self.__shm.buf, self.__bitmapSize + 4 * slot)[0]
+
+    def __isAlive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+if(hasattr(os, "register_at_fork")):
+    os.register_at_fork(after_in_child=SharedObjectPool._afterForkInChild)
+
+
+# 基于框架的实现
+#==============================
+class SharedPowerBankPool(SharedObjectPool):
+    """多个网点共用的智能箱盒, 所有网点同时借出的移动电源不超过槽位数量"""
+
+    def createPooledObject(self):
+        return PooledObject(PowerBank(PowerBankPool.getSerialNum(), 100))
+
+
+# Test
+#=======================================================================================================================
+def usePowerBanks(powerBankPool, worker, times, results):
+    """工作进程: 反复借用和归还移动电源"""
+    maxBusySlots = 0
+    for i in range(0, times):
+        powerBank = powerBankPool.borrowObject(timeout=5)
+        maxBusySlots = max(maxBusySlots, powerBankPool.getNumOfBusySlots())
+        time.sleep(0.001)
+        powerBankPool.returnObject(powerBank)
+    results.put((worker, maxBusySlots))
+
+
+def testSharedObjectPool():
+    context = multiprocessing.get_context("spawn")
+    powerBankPool = SharedPowerBankPool(3, context.Lock())
+    results = context.Queue()
+    workers = [context.Process(target=usePowerBanks, args=(powerBankPool, i, 50, results)) for i in range(0, 4)]
+    for worker in workers:
+        worker.start()
+    for i in range(0, len(workers)):
+        worker, maxBusySlots = results.get()
+        print("工作进程%d 最多同时占用的槽位:%d" % (worker, maxBusySlots))
+    for worker in workers:
+        worker.join()
+    print("结束后占用的槽位:%d" % powerBankPool.getNumOfBusySlots())
+    powerBankPool.close()
+
+
+def useAndClosePool(powerBankPool, times):
+    """fork出的工作进程: 借用和归还后断开共享内存"""
+    for i in range(0, times):
+        powerBankPool.returnObject(powerBankPool.borrowObject(timeout=5))
+    powerBankPool.close()
+
+
+def testSharedObjectPoolFork():
+    """fork出的工作进程继承了对象池, 它们close时不能删除父进程创建的共享内存"""
+    context = multiprocessing.get_context("fork")
+    powerBankPool = SharedPowerBankPool(3, context.Lock())
+    # 父进程先借出一个, fork出的子进程不能替父进程归还
+    powerBank = powerBankPool.borrowObject()
+    workers = [context.Process(target=useAndClosePool, args=(powerBankPool, 50)) for i in range(0, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print("工作进程的退出码:%s  父进程占用的槽位:%d"
+          % ([worker.exitcode for worker in workers], powerBankPool.getNumOfBusySlots()))
+    powerBankPool.returnObject(powerBank)
+    powerBankPool.close()
+    print("父进程close成功")
+
+
+# 工作进程以spawn方式启动时会重新导入本模块(和主程序), 测试代码只在主进程中执行
+if(multiprocessing.current_process().name == "MainProcess"):
+    testSharedObjectPool()
+    if("fork" in multiprocessing.get_all_start_methods()):
+        testSharedObjectPoolFork()
@@ -0,0 +1,238 @@
+"""
+模式: 对象池模式
+功能: 分片(条带化)的对象池, 每个线程固定使用一个子对象池, 本地子对象池为空时从相邻的子对象池中"窃取"
+说明: 线程安全的对象池只有一把锁, 线程很多时锁会成为瓶颈; 分片后不同线程大多落在不同的锁上
+     CPython有GIL, 分片本身带来的提升有限(见testStripedObjectPoolPerformance), 主要的收益来自子对象池很简单:
+     借用和归还在锁内只做一次出队或入队, 不创建等待条件, 也不记录租约
+"""
+from abc import ABCMeta, abstractmethod
+# 引入ABCMeta和abstractmethod来定义抽象类和抽象方法
+from collections import deque
+# 引入双端队列, 存放子对象池中的空闲对象
+import itertools
+# 引入迭代器工具模块, 用于给线程分配子对象池
+import threading
+# 引入线程模块
+import time
+# 引入时间模块
+from advanced_pattern.ObjectPool import BlockingPowerBankPool, PooledObject, PowerBank, PowerBankPool
+# 引入线程安全的对象池和移动电源
+
+
+class Shard:
+    """子对象池: 一把普通的锁保护一个空闲对象队列, 借用和归还在锁内只做一次出队或入队
+    不记录借出的对象, 也不为每次借用创建等待条件, 这些都由分片对象池负责或者只在等待时才需要"""
+
+    def __init__(self, createPooledObject, initialNumOfObjects, maxNumOfObjects):
+        self.__createPooledObject = createPooledObject
+        self.__maxNumOfObjects = maxNumOfObjects
+        self.__freeObjects = deque(createPooledObject() for i in range(0, initialNumOfObjects))
+        self.__numOfObjects = initialNumOfObjects
+        self.__lock = threading.Lock()
+        # 所有子对象池都借不到对象时, 线程在本地子对象池上等待
+        self.__available = threading.Condition(self.__lock)
+        self.__numOfWaiters = 0
+
+    def tryBorrow(self, blocking=True):
+        """取出一个空闲的池对象, 没有空闲对象且未达到最大数量时在锁外创建一个; 借不到则返回None
+        blocking为False时锁被其他线程占用就直接放弃, 用于窃取"""
+        if(not self.__lock.acquire(blocking)):
+            return None
+        try:
+            if(self.__freeObjects):
+                # 最近归还的对象最先借出
+                return self.__freeObjects.pop()
+            if(self.__numOfObjects >= self.__maxNumOfObjects):
+                return None
+            self.__numOfObjects += 1
+        finally:
+            self.__lock.release()
+        try:
+            return self.__createPooledObject()
+        except BaseException:
+            with self.__lock:
+                self.__numOfObjects -= 1
+            raise
+
+    def giveBack(self, pooledObj):
+        with self.__lock:
+            self.__freeObjects.append(pooledObj)
+            if(self.__numOfWaiters > 0):
+                self.__available.notify()
+
+    def waitForObject(self, timeout):
+        """没有空闲对象时等待有对象归还, 最多等待timeout秒"""
+        with self.__lock:
+            if(self.__freeObjects):
+                return
+            self.__numOfWaiters += 1
+            try:
+                self.__available.wait(timeout)
+            finally:
+                self.__numOfWaiters -= 1
+
+    def getNumOfObjects(self):
+        return self.__numOfObjects
+
+    def getNumOfFreeObjects(self):
+        return len(self.__freeObjects)
+
+    def clear(self):
+        """清除空闲的对象"""
+        with self.__lock:
+            self.__numOfObjects -= len(self.__freeObjects)
+            self.__freeObjects.clear()
+
+
+class StripedObjectPool(metaclass=ABCMeta):
+    """分片对象池"""
+
+    """对象池初始化大小"""
+    InitialNumOfObjects = 10
+    """对象池最大的大小"""
+    MaxNumOfObjects = 50
+    """等待对象时每隔多久(秒)重新尝试从其他子对象池窃取"""
+    StealInterval = 0.01
+
+    def __init__(self, numOfShards=8, initialNumOfObjects=None, maxNumOfObjects=None):
+        if(initialNumOfObjects is not None):
+            self.InitialNumOfObjects = initialNumOfObjects
+        if(maxNumOfObjects is not None):
+            self.MaxNumOfObjects = maxNumOfObjects
+        # 对象池的大小平均分到每个子对象池
+        self.__shards = [Shard(self.createPooledObject, self.__split(self.InitialNumOfObjects, numOfShards, i),
+                               self.__split(self.MaxNumOfObjects, numOfShards, i))
+                         for i in range(0, numOfShards)]
+        # 借出的对象所属的子对象池和池对象, 以对象的id为键
+        self.__owners = {}
+        # 线程第一次借用时按轮转的方式分配子对象池
+        self.__nextShard = itertools.count()
+        self.__local = threading.local()
+        self.__stealLock = threading.Lock()
+        self.__numOfSteals = 0
+
+    @abstractmethod
+    def createPooledObject(self):
+        """创建池对象, 由子类实现该方法"""
+        pass
+
+    def borrowObject(self, timeout=None):
+        """借用对象: 先从本线程的子对象池借用, 借不到则从相邻的子对象池窃取
+        timeout为None时一直等待, 为0时不等待; 超时仍未借到则返回None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        index = self.__getShardIndex()
+        localShard = self.__shards[index]
+        while True:
+            shard = localShard
+            pooledObj = shard.tryBorrow()
+            if(pooledObj is None):
+                shard, pooledObj = self.__steal(index)
+            if(pooledObj is not None):
+                break
+            # 都没有空闲对象, 在本地子对象池上等待一会儿后再重试
+            wait = self.StealInterval
+            if(deadline is not None):
+                wait = min(wait, deadline - time.monotonic())
+                if(wait <= 0):
+                    return None
+            localShard.waitForObject(wait)
+        pooledObj.setBusy(True)
+        obj = pooledObj.getObject()
+        self.__owners[id(obj)] = (shard, pooledObj)
+        return obj
+
+    def returnObject(self, obj):
+        """归还对象到它所属的子对象池"""
+        owner = self.__owners.pop(id(obj), None)
+        if(owner is not None):
+            shard, pooledObj = owner
+            pooledObj.setBusy(False)
+            shard.giveBack(pooledObj)
+
+    def getNumOfObjects(self):
+        return sum(shard.getNumOfObjects() for shard in self.__shards)
+
+    def getNumOfFreeObjects(self):
+        return sum(shard.getNumOfFreeObjects() for shard in self.__shards)
+
+    def getNumOfSteals(self):
+        """从其他子对象池窃取的次数"""
+        return self.__numOfSteals
+
+    def clear(self):
+        """清除空闲的对象"""
+        for shard in self.__shards:
+            shard.clear()
+
+    def __getShardIndex(self):
+        index = getattr(self.__local, "shardIndex", None)
+        if(index is None):
+            index = next(self.__nextShard) % len(self.__shards)
+            self.__local.shardIndex = index
+        return index
+
+    def __steal(self, index):
+        """依次尝试相邻的子对象池, 锁被占用的子对象池直接跳过, 返回(子对象池, 池对象)"""
+        numOfShards = len(self.__shards)
+        for step in range(1, numOfShards):
+            shard = self.__shards[(index + step) % numOfShards]
+            pooledObj = shard.tryBorrow(blocking=False)
+            if(pooledObj is not None):
+                with self.__stealLock:
+                    self.__numOfSteals += 1
+                return shard, pooledObj
+        return None, None
+
+    @staticmethod
+    def __split(total, numOfShards, index):
+        return total // numOfShards + (1 if index < total % numOfShards else 0)
+
+
+# 基于框架的实现
+#==============================
+class StripedPowerBankPool(StripedObjectPool):
+    """由多个智能箱盒组成的租借点, 每个顾客固定到一个箱盒借用, 箱盒空了再去隔壁的箱盒借"""
+
+    def createPooledObject(self):
+        return PooledObject(PowerBank(PowerBankPool.getSerialNum(), 100))
+
+
+# Test
+#=======================================================================================================================
+def testStripedObjectPool():
+    powerBankPool = StripedPowerBankPool(4, 4, 4)
+    powerBanks = [powerBankPool.borrowObject(timeout=0) for i in range(0, 4)]
+    print("单个线程借到了%d个移动电源, 窃取了%d次" % (len([p for p in powerBanks if p is not None]), powerBankPool.getNumOfSteals()))
+    for powerBank in powerBanks:
+        powerBankPool.returnObject(powerBank)
+    print("归还后的空闲对象数量:%d" % powerBankPool.getNumOfFreeObjects())
+
+
+def testStripedObjectPoolPerformance():
+    """比较单锁对象池和分片对象池在1到64个线程下的借用+归还吞吐量"""
+    totalTimes = 200000
+
+    def run(pool, numOfThreads):
+        def work():
+            for i in range(0, totalTimes // numOfThreads):
+                pool.returnObject(pool.borrowObject())
+
+        threads = [threading.Thread(target=work) for i in range(0, numOfThreads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totalTimes / (time.perf_counter() - start)
+
+    # 只有1个分片的分片对象池: 与单锁对象池的差别来自更简单的借用和归还, 与16个分片的差别才来自分片
+    for numOfThreads in (1, 2, 4, 8, 16, 32, 64):
+        singleLock = run(BlockingPowerBankPool(64, 64), numOfThreads)
+        oneShard = run(StripedPowerBankPool(1, 64, 64), numOfThreads)
+        striped = run(StripedPowerBankPool(16, 64, 64), numOfThreads)
+        print("线程数:%2d  单锁对象池:%8.0f次/秒  1个分片:%8.0f次/秒  16个分片:%8.0f次/秒"
+              % (numOfThreads, singleLock, oneShard, striped))
+
+
+testStripedObjectPool()
+# testStripedObjectPoolPerformance()